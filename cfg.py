@@ -27,7 +27,17 @@ class Static:
 
     app_exts = (".app", ".APP")
 
+    # функция ключа содержимого файла (Utils.get_partial_hash):
+    # "sha256", "blake2b" или "xxh3" (нужен пакет xxhash).
+    # sha256 в OpenSSL считается инструкциями процессора (Apple Silicon,
+    # x86 с SHA-NI) и на 0.4 МБ быстрее blake2b, xxh3 быстрее обоих.
+    # Смена функции меняет ключи всех файлов, миниатюры создадутся заново
+    content_key = "sha256"
+
     max_thumb_size = 210
+    # для видео в кэш миниатюр кладется постер крупнее,
+    # его показывает просмотрщик вместо повторного декодирования
+    video_poster_size = 1280
     thumb_heights = [130, 150, 185, 270]
     thumb_widths = [145, 145, 180, 230]
     image_sizes = [50, 70, 100, 170]
@@ -43,6 +53,12 @@ class JsonData:
     go_to_now = False
     dark_mode = None    
     show_text = False
+    # лимит размера папки thumbnails в МБ, старые миниатюры удаляются
+    thumbs_limit_mb = 2048
+    # с какой папки-шарда thumbnails продолжит проверку CacheReaper
+    cache_check_shard = 0
+    # новые миниатюры пишутся в общие файлы ThumbPack, а не по одному файлу
+    thumbs_packed = False
 
     @classmethod
     def get_data(cls):
@@ -2,14 +2,15 @@ import os
 import sys
 import traceback
 
-from PyQt5.QtCore import QEvent, QObject, Qt
+from PyQt5.QtCore import QEvent, QObject, Qt, QTimer
 from PyQt5.QtWidgets import (QApplication, QDialog, QPushButton, QTextEdit,
                              QVBoxLayout)
 
 from cfg import JsonData
 from system.database import Dbase
-from system.multiprocess import ProcessWorker
-from system.tasks import OnStartTask, UThreadPool
+from system.multiprocess import ProcessWorker, ThumbPool
+from system.tasks import (CacheLimiter, CacheReaper, OnStartTask,
+                          ThumbPackCompactor, ThumbSizeFiller, UThreadPool)
 from widgets._base_widgets import WinBase
 from widgets.win_main import WinMain
 
@@ -74,6 +75,8 @@ class Tools:
 
 
 class App(QApplication):
+    cache_tasks_ms = 10 * 60 * 1000
+
     def __init__(self, argv: list[str]) -> None:
         QApplication.setAttribute(Qt.ApplicationAttribute.AA_EnableHighDpiScaling, True)
         QApplication.setAttribute(Qt.ApplicationAttribute.AA_UseHighDpiPixmaps, True)
@@ -85,15 +88,47 @@ class App(QApplication):
 
     def load_data(self):
         def fin():
+            # процессы миниатюр запускаются заранее, до первой прокрутки
+            ThumbPool.start()
             self.main_win = WinMain()
             self.main_win.show()
             self.aboutToQuit.connect(lambda: self.main_win.on_exit())
             self.installEventFilter(self)
+            self.start_cache_tasks()
+            self.cache_tasks_timer = QTimer(self)
+            self.cache_tasks_timer.timeout.connect(self.start_cache_tasks)
+            self.cache_tasks_timer.start(self.cache_tasks_ms)
 
         self.on_start_task = OnStartTask()
         self.on_start_task.sigs.finished_.connect(fin)
         UThreadPool.start(self.on_start_task)
 
+    def start_cache_tasks(self):
+        """
+        Фоновое обслуживание кэша миниатюр:
+        ThumbSizeFiller узнает размер миниатюр, записанных без thumb_size,
+        CacheLimiter держит кэш в пределах лимита,
+        CacheReaper удаляет файлы и строки БД без пары,
+        ThumbPackCompactor переписывает файлы ThumbPack без удаленных миниатюр.
+        Задача не запускается, если прошлая еще работает.
+        """
+        task = getattr(self, "thumb_size_filler", None)
+        if task is None or task.is_finished():
+            self.thumb_size_filler = ThumbSizeFiller()
+            UThreadPool.start(self.thumb_size_filler)
+        task = getattr(self, "cache_limiter", None)
+        if task is None or task.is_finished():
+            self.cache_limiter = CacheLimiter()
+            UThreadPool.start(self.cache_limiter)
+        task = getattr(self, "cache_reaper", None)
+        if task is None or task.is_finished():
+            self.cache_reaper = CacheReaper()
+            UThreadPool.start(self.cache_reaper)
+        task = getattr(self, "thumb_pack_compactor", None)
+        if task is None or task.is_finished():
+            self.thumb_pack_compactor = ThumbPackCompactor()
+            UThreadPool.start(self.thumb_pack_compactor)
+
     def eventFilter(self, a0: QObject | None, a1: QEvent | None) -> bool:
         if a1.type() == QEvent.Type.ApplicationActivate:
             for i in WinBase.wins:
@@ -102,6 +137,7 @@ class App(QApplication):
         return False
 
     def on_exit(self):
+        ThumbPool.stop()
         ProcessWorker.stop_all()
         JsonData.write_json_data()
 
@@ -1,8 +1,13 @@
+import fcntl
+import mmap
 import os
 import subprocess
+import threading
 import traceback
+from collections import OrderedDict
 
 import sqlalchemy
+from sqlalchemy.dialects import sqlite
 
 from cfg import Static
 from system.shared_utils import SharedUtils
@@ -23,6 +28,51 @@ _CACHE = sqlalchemy.Table(
     sqlalchemy.Column("rating", sqlalchemy.Integer),
     sqlalchemy.Column("partial_hash", sqlalchemy.Text),
     sqlalchemy.Column("thumb_path", sqlalchemy.Text),
+    # размер файла миниатюры в байтах
+    sqlalchemy.Column("thumb_size", sqlalchemy.Integer),
+    # миниатюра в общем файле ThumbPack вместо отдельного файла thumb_path
+    sqlalchemy.Column("pack_id", sqlalchemy.Integer),
+    sqlalchemy.Column("pack_offset", sqlalchemy.Integer),
+    sqlalchemy.Column("pack_length", sqlalchemy.Integer),
+    # ImgLoader.set_ratings и RatingTask ищут строки по partial_hash,
+    # у папок partial_hash = Utils.get_folder_hash
+    sqlalchemy.Index("ix_cache_partial_hash", "partial_hash", unique=True),
+    # CacheLimiter удаляет давно не читавшиеся миниатюры
+    sqlalchemy.Index("ix_cache_last_read", "last_read"),
+    # ThumbPackCompactor собирает живые записи каждого файла ThumbPack
+    sqlalchemy.Index("ix_cache_pack_id", "pack_id"),
+)
+
+_SCHEMA_VERSION = sqlalchemy.Table(
+    "schema_version", _METADATA,
+    sqlalchemy.Column("version", sqlalchemy.Integer),
+)
+
+
+# одна строка id=1 с суммарным размером и числом миниатюр,
+# обновляется триггерами при вставке, обновлении и удалении строк cache
+_THUMBS_STATS = sqlalchemy.Table(
+    "thumbs_stats", _METADATA,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("total", sqlalchemy.Integer),
+    sqlalchemy.Column("count", sqlalchemy.Integer),
+)
+
+
+# partial_hash файла по его пути и данным stat (HashMemo),
+# чтобы не читать заново начало неизмененного файла
+_HASH_MEMO = sqlalchemy.Table(
+    "hash_memo", _METADATA,
+    sqlalchemy.Column("path", sqlalchemy.Text, primary_key=True),
+    sqlalchemy.Column("size", sqlalchemy.Integer),
+    sqlalchemy.Column("mod_ns", sqlalchemy.Integer),
+    sqlalchemy.Column("inode", sqlalchemy.Integer),
+    sqlalchemy.Column("partial_hash", sqlalchemy.Text),
+    # Utils.get_content_key, которым посчитан partial_hash:
+    # после смены Static.content_key запись не подходит
+    sqlalchemy.Column("content_key", sqlalchemy.Text),
+    # CacheLimiter удаляет записи вместе со строками cache
+    sqlalchemy.Index("ix_hash_memo_partial_hash", "partial_hash"),
 )
 
 
@@ -38,58 +88,692 @@ class CacheTable:
     rating = _CACHE.c.rating
     partial_hash = _CACHE.c.partial_hash
     thumb_path = _CACHE.c.thumb_path
+    thumb_size = _CACHE.c.thumb_size
+    pack_id = _CACHE.c.pack_id
+    pack_offset = _CACHE.c.pack_offset
+    pack_length = _CACHE.c.pack_length
+
+
+class ThumbsStatsTable:
+    table = _THUMBS_STATS
+    id = _THUMBS_STATS.c.id
+    total = _THUMBS_STATS.c.total
+    count = _THUMBS_STATS.c.count
+
+
+class HashMemoTable:
+    table = _HASH_MEMO
+    path = _HASH_MEMO.c.path
+    size = _HASH_MEMO.c.size
+    mod_ns = _HASH_MEMO.c.mod_ns
+    inode = _HASH_MEMO.c.inode
+    partial_hash = _HASH_MEMO.c.partial_hash
+    content_key = _HASH_MEMO.c.content_key
+
+
+def _add_missing_columns(conn: sqlalchemy.Connection):
+    """
+    Добавляет в существующие таблицы колонки, которых в них еще нет.
+    ALTER TABLE ADD COLUMN не трогает уже записанные строки,
+    поэтому рейтинги и thumb_path сохраняются.
+    """
+    for table in _METADATA.sorted_tables:
+        q = sqlalchemy.text(f"PRAGMA table_info({table.name})")
+        exist_columns = [i[1] for i in conn.execute(q).fetchall()]
+        for column in table.columns:
+            if column.name in exist_columns:
+                continue
+            col_type = column.type.compile(dialect=conn.dialect)
+            q = sqlalchemy.text(
+                f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"
+            )
+            conn.execute(q)
+            print(f"БД: добавлена колонка {table.name}.{column.name}")
+
+
+def _remove_duplicate_hashes(conn: sqlalchemy.Connection):
+    """
+    Удаляет повторные строки с одинаковым partial_hash, оставляя самую
+    новую. Без этого нельзя создать уникальный индекс по partial_hash.
+    RatingTask обновлял рейтинг сразу во всех дублях, поэтому рейтинг
+    у оставшейся строки актуальный.
+    """
+    keep_ids = (
+        sqlalchemy.select(sqlalchemy.func.max(_CACHE.c.id))
+        .where(_CACHE.c.partial_hash.is_not(None))
+        .group_by(_CACHE.c.partial_hash)
+    )
+    q = (
+        sqlalchemy.delete(_CACHE)
+        .where(_CACHE.c.partial_hash.is_not(None))
+        .where(_CACHE.c.id.not_in(keep_ids))
+    )
+    res = conn.execute(q)
+    if res.rowcount:
+        print(f"БД: удалено дублей partial_hash: {res.rowcount}")
+
+
+def _create_missing_indexes(conn: sqlalchemy.Connection):
+    """
+    Создает индексы, описанные в _METADATA, если их еще нет в БД.
+    """
+    for table in _METADATA.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _add_cache_indexes(conn: sqlalchemy.Connection):
+    _remove_duplicate_hashes(conn)
+    _create_missing_indexes(conn)
+
+
+_THUMBS_STATS_TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS thumbs_stats_insert
+    AFTER INSERT ON {_TABLE_NAME}
+    WHEN NEW.thumb_size IS NOT NULL
+    BEGIN
+        UPDATE thumbs_stats
+        SET total = total + NEW.thumb_size, count = count + 1
+        WHERE id = 1;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS thumbs_stats_delete
+    AFTER DELETE ON {_TABLE_NAME}
+    WHEN OLD.thumb_size IS NOT NULL
+    BEGIN
+        UPDATE thumbs_stats
+        SET total = total - OLD.thumb_size, count = count - 1
+        WHERE id = 1;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS thumbs_stats_update
+    AFTER UPDATE OF thumb_size ON {_TABLE_NAME}
+    BEGIN
+        UPDATE thumbs_stats
+        SET
+            total = total
+                + COALESCE(NEW.thumb_size, 0)
+                - COALESCE(OLD.thumb_size, 0),
+            count = count
+                + (NEW.thumb_size IS NOT NULL)
+                - (OLD.thumb_size IS NOT NULL)
+        WHERE id = 1;
+    END
+    """,
+)
+
+
+def _sync_thumbs_stats(conn: sqlalchemy.Connection):
+    """
+    Пересчитывает строку thumbs_stats по колонке cache.thumb_size.
+    """
+    stats = sqlalchemy.select(
+        sqlalchemy.literal(1),
+        sqlalchemy.func.coalesce(sqlalchemy.func.sum(_CACHE.c.thumb_size), 0),
+        sqlalchemy.func.count(_CACHE.c.thumb_size),
+    )
+    q = (
+        sqlalchemy.insert(_THUMBS_STATS)
+        .prefix_with("OR REPLACE")
+        .from_select(["id", "total", "count"], stats)
+    )
+    conn.execute(q)
+
+
+def _fill_thumb_sizes(
+    conn: sqlalchemy.Connection,
+    missing_only: bool,
+    last_id: int,
+    batch: int
+) -> int | None:
+    """
+    Записывает в cache.thumb_size размер файла thumb_path для batch строк
+    с id больше last_id. Счетчики thumbs_stats меняет триггер.
+    missing_only: только строки, где thumb_size еще не известен.
+    Строки, чей файл не найден, получают NULL.
+    Возвращает id последней строки или None, если строк больше нет.
+    """
+    stmt = (
+        sqlalchemy.select(_CACHE.c.id, _CACHE.c.thumb_path)
+        .where(_CACHE.c.id > last_id)
+        .where(_CACHE.c.thumb_path.is_not(None))
+        .order_by(_CACHE.c.id)
+        .limit(batch)
+    )
+    if missing_only:
+        stmt = stmt.where(_CACHE.c.thumb_size.is_(None))
+    rows = conn.execute(stmt).fetchall()
+    if not rows:
+        return None
+    values = []
+    for id_, thumb_path in rows:
+        try:
+            size = os.path.getsize(thumb_path)
+        except OSError:
+            size = None
+        values.append({"b_id": id_, "b_size": size})
+    stmt = (
+        sqlalchemy.update(_CACHE)
+        .where(_CACHE.c.id == sqlalchemy.bindparam("b_id"))
+        .values(thumb_size=sqlalchemy.bindparam("b_size"))
+    )
+    conn.execute(stmt, values)
+    return rows[-1].id
+
+
+def _fill_missing_thumb_sizes(conn: sqlalchemy.Connection):
+    # размеры миниатюр, созданных до колонки thumb_size, заполняет
+    # фоновая задача ThumbSizeFiller: на большом или сетевом кэше
+    # обход файлов здесь задерживал бы запуск GUI
+    pass
+
+
+def _add_thumbs_stats(conn: sqlalchemy.Connection):
+    _add_missing_columns(conn)
+    for i in _THUMBS_STATS_TRIGGERS:
+        conn.execute(sqlalchemy.text(i))
+    _sync_thumbs_stats(conn)
+
+
+def _drop_folder_index(conn: sqlalchemy.Connection):
+    # папки теперь ищутся по partial_hash, индекс по пяти колонкам
+    # только замедляет запись
+    conn.execute(sqlalchemy.text("DROP INDEX IF EXISTS ix_cache_folder"))
+
+
+def _add_thumb_packs(conn: sqlalchemy.Connection):
+    _add_missing_columns(conn)
+    _create_missing_indexes(conn)
+
+
+def _clear_hash_memo(conn: sqlalchemy.Connection):
+    # в hash_memo лежат ключи sha256, Utils.get_partial_hash
+    # теперь считает ключ иначе
+    conn.execute(sqlalchemy.delete(_HASH_MEMO))
+
+
+# Упорядоченные шаги миграции схемы.
+# Номер версии схемы равен порядковому номеру шага (с единицы).
+# Новые шаги добавляются только в конец списка, старые не меняются.
+# Каждый шаг должен спокойно переживать повторный запуск, т.к. новая
+# БД создается через create_all сразу в актуальном виде.
+_MIGRATIONS: list[callable] = [
+    _add_missing_columns,
+    _add_cache_indexes,
+    _create_missing_indexes,
+    _add_thumbs_stats,
+    _drop_folder_index,
+    _add_thumb_packs,
+    _clear_hash_memo,
+    # строки hash_memo без content_key не загружаются и перезаписываются
+    _add_missing_columns,
+    _fill_missing_thumb_sizes,
+]
+
+
+class HashCache:
+    """
+    Ограниченный LRU кэш в памяти процесса перед таблицей cache:
+    partial_hash: (rating, thumb_path)
+    Чтение: get, при промахе данные берутся из БД и кладутся через put.
+    Запись рейтинга: после записи в БД вызывается set_rating.
+    У каждого процесса свой кэш, поэтому set_rating и clear сообщают
+    об изменениях в listeners (ThumbPool пересылает их своим процессам).
+    """
+    max_size = 50000
+    _data: OrderedDict[str, tuple[int, str | None]] = OrderedDict()
+    _lock = threading.Lock()
+    hits = 0
+    misses = 0
+    # callable(action: str, *args), action: "set_rating" | "clear"
+    listeners: list[callable] = []
+
+    @classmethod
+    def get(cls, partial_hash: str) -> tuple[int, str | None] | None:
+        with cls._lock:
+            value = cls._data.get(partial_hash)
+            if value is None:
+                cls.misses += 1
+                return None
+            cls._data.move_to_end(partial_hash)
+            cls.hits += 1
+            return value
+
+    @classmethod
+    def put(cls, partial_hash: str, rating: int, thumb_path: str | None):
+        with cls._lock:
+            cls._data[partial_hash] = (rating, thumb_path)
+            cls._data.move_to_end(partial_hash)
+            while len(cls._data) > cls.max_size:
+                cls._data.popitem(last=False)
+
+    @classmethod
+    def set_rating(cls, partial_hash: str, rating: int):
+        """
+        Обновляет рейтинг, если запись уже есть в кэше.
+        Если записи нет, при следующем чтении она придет из БД.
+        """
+        with cls._lock:
+            value = cls._data.get(partial_hash)
+            if value is not None:
+                cls._data[partial_hash] = (rating, value[1])
+        for i in cls.listeners:
+            i("set_rating", partial_hash, rating)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._data.clear()
+        for i in cls.listeners:
+            i("clear")
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        return {"hits": cls.hits, "misses": cls.misses, "size": len(cls._data)}
+
+
+class HashMemo:
+    """
+    partial_hash файла по пути и stat_key (size, st_mtime_ns, st_ino).
+    Пока stat_key и Utils.get_content_key не изменились,
+    partial_hash не пересчитывается,
+    поэтому при повторном открытии папки (в том числе сетевой) файлы
+    только stat-ятся, а не читаются.
+    В памяти процесса ограниченный LRU, в БД таблица hash_memo:
+    load заранее одним запросом берет записи из БД, новые записи
+    копятся в памяти и пишутся в БД через save.
+    """
+    max_size = 100000
+    # path: ((stat_key, content_key), partial_hash)
+    _data: OrderedDict[str, tuple[tuple, str]] = OrderedDict()
+    # новые записи, которых еще нет в БД
+    _unsaved: OrderedDict[str, tuple[tuple, str]] = OrderedDict()
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, path: str, stat_key: tuple) -> str | None:
+        with cls._lock:
+            value = cls._data.get(path)
+            if value is None or value[0] != (stat_key, Utils.get_content_key()):
+                return None
+            cls._data.move_to_end(path)
+            return value[1]
+
+    @classmethod
+    def _put(cls, data: OrderedDict, path: str, value: tuple):
+        data[path] = value
+        data.move_to_end(path)
+        while len(data) > cls.max_size:
+            data.popitem(last=False)
+
+    @classmethod
+    def put(cls, path: str, stat_key: tuple, partial_hash: str, saved: bool = False):
+        """
+        saved: запись пришла из БД, повторно писать ее не нужно.
+        """
+        value = ((stat_key, Utils.get_content_key()), partial_hash)
+        with cls._lock:
+            cls._put(cls._data, path, value)
+            if not saved:
+                cls._put(cls._unsaved, path, value)
+
+    @classmethod
+    def load(cls, conn: sqlalchemy.Connection, paths: list[str]):
+        """
+        Берет из БД записи путей, которых нет в памяти.
+        """
+        with cls._lock:
+            paths = [i for i in paths if i not in cls._data]
+        if not paths:
+            return
+        stmt = (
+            sqlalchemy.select(
+                HashMemoTable.path,
+                HashMemoTable.size,
+                HashMemoTable.mod_ns,
+                HashMemoTable.inode,
+                HashMemoTable.partial_hash
+            )
+            .where(HashMemoTable.path.in_(paths))
+            .where(HashMemoTable.content_key == Utils.get_content_key())
+        )
+        for path, size, mod_ns, inode, partial_hash in conn.execute(stmt):
+            cls.put(path, (size, mod_ns, inode), partial_hash, saved=True)
+
+    @classmethod
+    def save(cls, conn: sqlalchemy.Connection):
+        """
+        Пишет новые записи в БД. Коммит на вызывающем.
+        """
+        with cls._lock:
+            values = [
+                {
+                    HashMemoTable.path.name: path,
+                    HashMemoTable.size.name: size,
+                    HashMemoTable.mod_ns.name: mod_ns,
+                    HashMemoTable.inode.name: inode,
+                    HashMemoTable.partial_hash.name: partial_hash,
+                    HashMemoTable.content_key.name: content_key,
+                }
+                for path, (((size, mod_ns, inode), content_key), partial_hash)
+                in cls._unsaved.items()
+            ]
+            cls._unsaved.clear()
+        if not values:
+            return
+        stmt = sqlite.insert(HashMemoTable.table).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[HashMemoTable.path],
+            set_={
+                i: stmt.excluded[i]
+                for i in (
+                    HashMemoTable.size.name,
+                    HashMemoTable.mod_ns.name,
+                    HashMemoTable.inode.name,
+                    HashMemoTable.partial_hash.name,
+                    HashMemoTable.content_key.name,
+                )
+            }
+        )
+        conn.execute(stmt)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._data.clear()
+            cls._unsaved.clear()
+
+
+class ThumbPack:
+    """
+    Хранение миниатюр в общих файлах (JsonData.thumbs_packed) вместо
+    отдельного файла на каждую миниатюру.
+    Файлы thumbnails/packs/<pack_id>.pack только дописываются в конец,
+    где лежит миниатюра (pack_id, pack_offset, pack_length), хранится
+    в строке cache. Чтение через mmap и cv2.imdecode на срезе.
+    Каждый процесс дописывает только в свой файл, новый номер файла
+    занимается созданием файла в режиме "xb". Пока файл открыт на запись,
+    на нем держится flock, такие файлы ThumbPackCompactor не трогает.
+    Удаленные миниатюры остаются в файле, пока ThumbPackCompactor
+    не перепишет файл.
+    """
+    ext = ".pack"
+    max_pack_size = 256 * pow(1024, 2)
+    _writer = None
+    _writer_id: int = None
+    _writer_pid: int = None
+    # pack_id: (mmap, st_ino), номер файла может достаться новому файлу
+    # после того, как ThumbPackCompactor удалил старый
+    _maps: dict[int, tuple["mmap.mmap", int]] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_dir(cls):
+        return os.path.join(Static.external_thumbs_dir, "packs")
+
+    @classmethod
+    def get_path(cls, pack_id: int):
+        return os.path.join(cls.get_dir(), f"{pack_id}{cls.ext}")
+
+    @classmethod
+    def get_pack_ids(cls) -> list[int]:
+        try:
+            names = os.listdir(cls.get_dir())
+        except FileNotFoundError:
+            return []
+        return sorted(
+            int(i[:-len(cls.ext)])
+            for i in names
+            if i.endswith(cls.ext) and i[:-len(cls.ext)].isdigit()
+        )
+
+    @classmethod
+    def _new_writer(cls):
+        os.makedirs(cls.get_dir(), exist_ok=True)
+        pack_id = max(cls.get_pack_ids(), default=0) + 1
+        while True:
+            try:
+                cls._writer = open(cls.get_path(pack_id), "xb")
+                break
+            except FileExistsError:
+                pack_id += 1
+        fcntl.flock(cls._writer, fcntl.LOCK_EX)
+        cls._writer_id = pack_id
+        cls._writer_pid = os.getpid()
+
+    @classmethod
+    def append(cls, data: bytes) -> tuple[int, int]:
+        """
+        Дописывает данные в файл текущего процесса.
+        Возвращает (pack_id, pack_offset).
+        """
+        with cls._lock:
+            if (
+                cls._writer is None
+                or cls._writer_pid != os.getpid()
+                or cls._writer.tell() + len(data) > cls.max_pack_size
+            ):
+                cls.close_writer()
+                cls._new_writer()
+            offset = cls._writer.tell()
+            cls._writer.write(data)
+            # строка в БД появится после записи, читатели других
+            # процессов должны увидеть данные целиком
+            cls._writer.flush()
+            return cls._writer_id, offset
+
+    @classmethod
+    def read(cls, pack_id: int, offset: int, length: int) -> bytes | None:
+        path = cls.get_path(pack_id)
+        with cls._lock:
+            try:
+                st_ino = os.stat(path).st_ino
+            except OSError:
+                cls._forget(pack_id)
+                return None
+            mm, mapped_ino = cls._maps.get(pack_id, (None, None))
+            # файл мог дописаться после того, как его открыли
+            if mm is None or mapped_ino != st_ino or offset + length > len(mm):
+                cls._forget(pack_id)
+                try:
+                    with open(path, "rb") as f:
+                        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                        st_ino = os.fstat(f.fileno()).st_ino
+                except (OSError, ValueError):
+                    return None
+                cls._maps[pack_id] = (mm, st_ino)
+            if offset + length > len(mm):
+                return None
+            return mm[offset:offset + length]
+
+    @classmethod
+    def is_locked(cls, pack_id: int) -> bool:
+        """
+        Файл открыт на запись каким-то процессом.
+        """
+        try:
+            with open(cls.get_path(pack_id), "rb") as f:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        return False
+
+    @classmethod
+    def _forget(cls, pack_id: int):
+        mm, _ = cls._maps.pop(pack_id, (None, None))
+        if mm is not None:
+            mm.close()
+
+    @classmethod
+    def forget(cls, pack_id: int):
+        with cls._lock:
+            cls._forget(pack_id)
+
+    @classmethod
+    def close_writer(cls):
+        if cls._writer is not None and cls._writer_pid == os.getpid():
+            cls._writer.close()
+        cls._writer = None
+        cls._writer_id = None
+        cls._writer_pid = None
+
+    @classmethod
+    def close(cls):
+        with cls._lock:
+            cls.close_writer()
+            for pack_id in list(cls._maps):
+                cls._forget(pack_id)
 
 
 class Dbase:
     main_engine: sqlalchemy.Engine
-    
+    # один движок с пулом соединений на процесс
+    _engine: sqlalchemy.Engine = None
+    _engine_pid: int = None
+
+    pragmas = (
+        # читатели не ждут писателя, а писатель не ждет читателей
+        "PRAGMA journal_mode=WAL",
+        # в режиме WAL этого достаточно, чтобы не повредить БД
+        "PRAGMA synchronous=NORMAL",
+        # 64 МБ кэша страниц (отрицательное значение в КБ)
+        "PRAGMA cache_size=-65536",
+        "PRAGMA mmap_size=268435456",
+    )
+
+    @classmethod
+    def _set_pragmas(cls, dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        for i in cls.pragmas:
+            cursor.execute(i)
+        cursor.close()
+
     @classmethod
     def create_engine(cls):
-        return sqlalchemy.create_engine(
-            f"sqlite:///{Static.external_db}",
-            echo=False,
-            connect_args={"check_same_thread": False, "timeout": 30}
-        )
+        """
+        Возвращает движок текущего процесса, создает его при первом вызове.
+        Дочерний процесс получает свой движок: соединения нельзя
+        передавать между процессами.
+        """
+        if cls._engine is None or cls._engine_pid != os.getpid():
+            engine = sqlalchemy.create_engine(
+                f"sqlite:///{Static.external_db}",
+                echo=False,
+                poolclass=sqlalchemy.QueuePool,
+                pool_size=5,
+                max_overflow=10,
+                connect_args={"check_same_thread": False, "timeout": 30}
+            )
+            sqlalchemy.event.listen(engine, "connect", cls._set_pragmas)
+            cls._engine = engine
+            cls._engine_pid = os.getpid()
+        return cls._engine
+
+    @classmethod
+    def dispose(cls):
+        """
+        Закрывает все соединения движка текущего процесса.
+        Нужно перед удалением файла БД.
+        """
+        if cls._engine is not None:
+            cls._engine.dispose()
+        cls._engine = None
+        cls._engine_pid = None
 
     @classmethod
     def init(cls):
-        engine = sqlalchemy.create_engine(
-            f"sqlite:///{Static.external_db}",
-            echo=False,
-            connect_args={"check_same_thread": False, "timeout": 30}
-        )
+        engine = cls.create_engine()
         Dbase.main_engine = engine
 
         try:
             os.makedirs(Static.app_dir, exist_ok=True)
             _METADATA.create_all(engine)
+            cls.migrate(engine)
             conn = Dbase.main_engine.connect()
             q = sqlalchemy.select(_CACHE)
             conn.execute(q).first()
             conn.close()
         except Exception as e:
             print(f"Ошибка при открытии БД: {e}")
-            if "no such column" in str(e):
-                print("Не хватает колонок в существующей таблице, создаю новую")
-                _METADATA.drop_all(engine)
-                _METADATA.create_all(engine)
-            else:
-                log_file = os.path.join(Static.app_dir, "log.txt")
-                with open(log_file, "w", encoding="utf-8") as f:
-                    f.write(
-                        "ОТПРАВЬТЕ ЭТО РАЗРАБОТЧИКУ:\n"
-                        "tg: evlosh\n"
-                        "email: evlosh@gmail.com\n"
-                        "\n"
-                        "***************************************\n\n"
-                        f"{traceback.format_exc()}\n"
-                        "***************************************\n"
-                    )
-                try:
-                    subprocess.Popen(["open", log_file])
-                except Exception:
-                    pass
-                SharedUtils.exit_force()
+            log_file = os.path.join(Static.app_dir, "log.txt")
+            with open(log_file, "w", encoding="utf-8") as f:
+                f.write(
+                    "ОТПРАВЬТЕ ЭТО РАЗРАБОТЧИКУ:\n"
+                    "tg: evlosh\n"
+                    "email: evlosh@gmail.com\n"
+                    "\n"
+                    "***************************************\n\n"
+                    f"{traceback.format_exc()}\n"
+                    "***************************************\n"
+                )
+            try:
+                subprocess.Popen(["open", log_file])
+            except Exception:
+                pass
+            SharedUtils.exit_force()
+
+    @classmethod
+    def get_schema_version(cls, conn: sqlalchemy.Connection) -> int:
+        q = sqlalchemy.select(sqlalchemy.func.max(_SCHEMA_VERSION.c.version))
+        return conn.execute(q).scalar() or 0
+
+    @classmethod
+    def migrate(cls, engine: sqlalchemy.Engine):
+        """
+        Доводит схему существующей БД до актуальной версии.
+        Выполняет по порядку шаги из _MIGRATIONS, которые еще не применялись,
+        и после каждого шага записывает новую версию в schema_version.
+        Таблица cache не пересоздается, данные в ней сохраняются.
+        """
+        with engine.begin() as conn:
+            current = cls.get_schema_version(conn)
+            for version, step in enumerate(_MIGRATIONS, start=1):
+                if version <= current:
+                    continue
+                print(f"БД: миграция схемы до версии {version}")
+                step(conn)
+                conn.execute(sqlalchemy.delete(_SCHEMA_VERSION))
+                conn.execute(
+                    sqlalchemy.insert(_SCHEMA_VERSION).values(version=version)
+                )
+
+    @classmethod
+    def get_thumbs_stats(cls, conn: sqlalchemy.Connection) -> dict:
+        """
+        Возвращает {"total": байты, "count": кол-во миниатюр}
+        без обхода папки thumbnails.
+        """
+        q = (
+            sqlalchemy.select(ThumbsStatsTable.total, ThumbsStatsTable.count)
+            .where(ThumbsStatsTable.id == 1)
+        )
+        res = conn.execute(q).first()
+        if res is None:
+            return {"total": 0, "count": 0}
+        return {"total": res.total, "count": res.count}
+
+    @classmethod
+    def sync_thumbs_stats(cls, conn: sqlalchemy.Connection):
+        _sync_thumbs_stats(conn)
+
+    @classmethod
+    def fill_thumb_sizes(
+        cls,
+        conn: sqlalchemy.Connection,
+        missing_only: bool,
+        last_id: int = 0,
+        batch: int = 1000
+    ) -> int | None:
+        """
+        Одна порция, см. _fill_thumb_sizes. Возвращает last_id
+        для следующей порции или None.
+        """
+        return _fill_thumb_sizes(conn, missing_only, last_id, batch)
 
     @classmethod
     def commit(cls, conn: sqlalchemy.Connection) -> None:
@@ -12,7 +12,7 @@ from PyQt5.QtGui import QImage
 from cfg import Static
 from system.shared_utils import ImgUtils
 
-from .database import CacheTable
+from .database import HashMemo
 from .utils import Utils
 
 
@@ -55,6 +55,12 @@ class SortItem:
 
 
 class DataItem:
+    __slots__ = (
+        "src", "filename", "type_", "rating", "mod", "birth", "size",
+        "stat_key", "uti_type", "partial_hash", "thumb_path",
+        "image_is_loaded", "must_hidden", "row", "col", "qimages",
+    )
+
     def __init__(self, src: str, rating: int = 0):
         super().__init__()
         self.src: str = src
@@ -64,6 +70,8 @@ class DataItem:
         self.mod: float = None
         self.birth: int = None
         self.size: int = None
+        # (size, st_mtime_ns, st_ino) для HashMemo
+        self.stat_key: tuple[int, int, int] = None
         self.uti_type: str = None
         self.partial_hash: str = None
         self.thumb_path: str = None
@@ -71,15 +79,35 @@ class DataItem:
         self.must_hidden: bool = False
         self.row, self.col = 0, 0
 
-        # {"src": QImage(), 100: Qimage(), 200: QImage, ...}
-        # словарь заполняется на основе Static.image_sizes
-        # так же дополняется ключом "src" с исходным qimage
+        # {"src": QImage(), 100: QImage()}
+        # "src" исходный qimage, уменьшенная копия создается в get_qimage
+        # только для размера, который сейчас показывает сетка
         self.qimages: dict[Literal["src"] | int, QImage] = {}
-        self.img_array: np.ndarray = None
+
+    def set_qimage(self, qimage: QImage):
+        """
+        Исходный qimage миниатюры, уменьшенные копии сбрасываются.
+        """
+        self.qimages = {"src": qimage}
+
+    def get_qimage(self, size: int) -> QImage:
+        """
+        Уменьшенная копия "src" создается при первом обращении.
+        Копия прежнего размера удаляется: хранятся только "src" и size.
+        """
+        qimage = self.qimages.get(size)
+        if qimage is None:
+            qimage = Utils.scaled(self.qimages["src"], size)
+            self.qimages = {"src": self.qimages["src"], size: qimage}
+        return qimage
 
     def set_hash_and_thumb_path(self):
+        if self.type_ == Static.folder_type:
+            self.partial_hash = Utils.get_folder_hash(self.filename, self.birth, self.src)
+            self.thumb_path = None
+            return
         try:
-            self.partial_hash = Utils.get_partial_hash(self.src)
+            self.partial_hash = self.get_partial_hash()
             if self.type_ in ImgUtils.ext_all:
                 thumb_path = Utils.get_abs_thumb_path(self.partial_hash)
                 if self.type_ in (".png", ".icns"):
@@ -88,6 +116,28 @@ class DataItem:
                     self.thumb_path = thumb_path + ".jpg"
         except Exception as e:
             print("items, BaseItem set partial hash error", e)
+
+    def calc_partial_hash(self) -> str:
+        """
+        partial_hash файла или папки без изменения DataItem:
+        для фоновых задач, которым DataItem из GUI не принадлежит.
+        """
+        if self.type_ == Static.folder_type:
+            return Utils.get_folder_hash(self.filename, self.birth, self.src)
+        return self.get_partial_hash()
+
+    def get_partial_hash(self) -> str:
+        """
+        Файл читается, только если HashMemo не знает partial_hash
+        для текущих данных stat.
+        """
+        if self.stat_key is None:
+            return Utils.get_partial_hash(self.src)
+        partial_hash = HashMemo.get(self.src, self.stat_key)
+        if partial_hash is None:
+            partial_hash = Utils.get_partial_hash(self.src)
+            HashMemo.put(self.src, self.stat_key, partial_hash)
+        return partial_hash
         
     def set_properties(self):
         """
@@ -107,12 +157,14 @@ class DataItem:
             self.mod = int(stat.st_mtime)
             self.birth = int(stat.st_birthtime)
             self.size = int(stat.st_size)
+            self.stat_key = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
 
         except Exception as e:
             print("items, BaseItem set properties error", e)
             self.mod = 0
             self.birth = 0
             self.size = 0
+            self.stat_key = None
 
     @classmethod
     def sort_(cls, data_items: list["DataItem"], sort_item: SortItem) -> list["DataItem"]:
@@ -141,21 +193,41 @@ class DataItem:
             key = lambda data_otem: getattr(data_otem, sort_item.get_sort_type())
             data_items.sort(key=key, reverse=sort_item.get_reversed())
             return data_items
-        
-    @classmethod
-    def get_folder_conds(cls, data_item: "DataItem"):
+
+    # поля DataItem, которые процесс передает в GUI (to_msg / from_msg)
+    msg_fields = (
+        "src", "filename", "type_", "mod", "birth", "size",
+        "stat_key", "partial_hash", "thumb_path", "rating",
+    )
+
+    def to_msg(self) -> tuple:
         """
-        Возвращает условия для поиска папки в базе данных
+        Кортеж полей вместо всего DataItem (qimages и пр.)
+        для передачи через Queue.
         """
-        conds = [
-            CacheTable.name == data_item.filename,
-            CacheTable.type == data_item.type_,
-            CacheTable.size == data_item.size,
-            CacheTable.birth == data_item.birth,
-            CacheTable.mod == data_item.mod,
-        ]
-        return sqlalchemy.and_(*conds)
-            
+        return tuple(getattr(self, i) for i in DataItem.msg_fields)
+
+    @classmethod
+    def from_msg(cls, msg: tuple) -> "DataItem":
+        data_item = cls(msg[0])
+        for k, v in zip(DataItem.msg_fields, msg):
+            setattr(data_item, k, v)
+        return data_item
+
+
+class ThumbMsg:
+    """
+    Результат ImgLoader для Thumb в GUI: только src, partial_hash,
+    rating и пиксели миниатюры (img_array может быть None).
+    """
+    __slots__ = ("src", "partial_hash", "rating", "img_array")
+
+    def __init__(self, src: str, partial_hash: str, rating: int, img_array: np.ndarray = None):
+        self.src = src
+        self.partial_hash = partial_hash
+        self.rating = rating
+        self.img_array = img_array
+
 
 class MainWinItem:
     def __init__(self):
@@ -1,23 +1,57 @@
+import heapq
+import io
+import math
 import os
+import queue as queue_module
 import shutil
-from multiprocessing import Process, Queue
+from collections import Counter
+from multiprocessing import (Process, Queue, SimpleQueue, resource_tracker,
+                             shared_memory)
 from pathlib import Path
 from time import sleep
 
 import numpy as np
 import sqlalchemy
 from PIL import Image
+from PyQt5.QtCore import QSocketNotifier
+from sqlalchemy.dialects import sqlite
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers.polling import PollingObserver as Observer
 
-from cfg import Static
-from system.database import CacheTable, Dbase
+from cfg import JsonData, Static
+from system.database import (CacheTable, Dbase, HashCache, HashMemo,
+                             ThumbPack)
 from system.items import (CopyItem, DataItem, DirItem, JpgConvertItem,
-                          MultipleInfoItem, PathFixerItem, SearchItem)
+                          MultipleInfoItem, PathFixerItem, SearchItem,
+                          ThumbMsg)
 from system.shared_utils import ImgUtils, PathFinder, SharedUtils
 from system.tasks import Utils
 
 
+class QueueNotifier:
+    """
+    Доставка сообщений из multiprocessing.Queue в GUI без опроса по QTimer:
+    QSocketNotifier следит за pipe очереди, callback(item) вызывается
+    для каждого сообщения, как только оно пришло.
+    """
+    def __init__(self, queue: Queue, callback: callable):
+        self.queue = queue
+        self.callback = callback
+        self.notifier = QSocketNotifier(queue._reader.fileno(), QSocketNotifier.Read)
+        self.notifier.activated.connect(self.read)
+
+    def read(self):
+        # callback может остановить процесс и закрыть очередь
+        while self.notifier is not None and not self.queue.empty():
+            self.callback(self.queue.get())
+
+    def stop(self):
+        if self.notifier is not None:
+            self.notifier.setEnabled(False)
+            self.notifier.deleteLater()
+            self.notifier = None
+
+
 class BaseProcessWorker:
     _registry = []
 
@@ -25,10 +59,48 @@ class BaseProcessWorker:
         super().__init__()
         self.process = Process(target=target, args=(*args, ))
         self._queues: list[Queue] = [a for a in args if hasattr(a, 'put')]
+        self._queue_notifiers: list[QueueNotifier] = []
+        self._finished_callbacks: list[callable] = []
+        self._sentinel_notifier: QSocketNotifier = None
         BaseProcessWorker._registry.append(self)
 
+    def connect_queue(self, queue: Queue, callback: callable):
+        """
+        callback(item) для каждого сообщения из queue, см. QueueNotifier.
+        """
+        self._queue_notifiers.append(QueueNotifier(queue, callback))
+
+    def connect_finished(self, callback: callable):
+        """
+        callback() после завершения процесса, когда все его сообщения
+        уже переданы в connect_queue. Подключать до start.
+        """
+        self._finished_callbacks.append(callback)
+
     def start(self):
         self.process.start()
+        if self._finished_callbacks:
+            # sentinel становится читаемым, когда процесс завершается
+            self._sentinel_notifier = QSocketNotifier(
+                self.process.sentinel, QSocketNotifier.Read
+            )
+            self._sentinel_notifier.activated.connect(self._on_finished)
+
+    def _on_finished(self):
+        self._stop_notifiers(queues=False)
+        for i in self._queue_notifiers:
+            i.read()
+        for i in self._finished_callbacks:
+            i()
+
+    def _stop_notifiers(self, queues: bool = True):
+        if self._sentinel_notifier is not None:
+            self._sentinel_notifier.setEnabled(False)
+            self._sentinel_notifier.deleteLater()
+            self._sentinel_notifier = None
+        if queues:
+            for i in self._queue_notifiers:
+                i.stop()
 
     def is_alive(self):
         return self.process.is_alive()
@@ -38,6 +110,7 @@ class BaseProcessWorker:
         Корректно terminate с join
         Завершает все очереди Queue
         """
+        self._stop_notifiers()
         self.process.terminate()
         self.process.join(timeout=0.2)
 
@@ -102,15 +175,34 @@ class DirScaner:
 
 
 class ImgLoader:
+    write_chunk = 10
+    # None - еще не проверено, см. has_legacy_keys
+    legacy_keys: bool = None
+
     @staticmethod
-    def start(data_items: list[DataItem], queue: Queue):
+    def start(data_items: list[DataItem], queue: Queue, packed: bool = False):
+        """
+        packed: новые миниатюры пишутся в ThumbPack (JsonData.thumbs_packed).
+        Уже созданные миниатюры читаются из того места, где лежат.
+        """
         data_items.sort(key=lambda x: x.size)
         new_images: list[DataItem] = []
         exist_images: list[DataItem] = []
         svg_files: list[DataItem] = []
 
+        engine = Dbase.create_engine()
+        with engine.connect() as conn:
+            HashMemo.load(conn, [i.src for i in data_items if i.stat_key])
         for data_item in data_items:
             data_item.set_hash_and_thumb_path()
+        with engine.begin() as conn:
+            HashMemo.save(conn)
+            ImgLoader.migrate_legacy_keys(data_items, conn)
+
+        for data_item in data_items:
+            # у папок есть только строка с рейтингом, миниатюры нет
+            if data_item.type_ == Static.folder_type:
+                continue
             if data_item.filename.endswith((".svg", ".SVG")):
                 svg_files.append(data_item)
             else:
@@ -119,10 +211,163 @@ class ImgLoader:
                 else:
                     new_images.append(data_item)
         
-        with Dbase.create_engine().begin() as conn:
+        with engine.begin() as conn:
             ImgLoader.set_ratings(data_items, queue, conn)
-            ImgLoader.execute_exist_images(exist_images, queue, conn)
-            ImgLoader.execute_new_images(new_images, queue, conn)
+            locations = ImgLoader.get_pack_locations(new_images, conn)
+            exist_images.extend(i for i in new_images if i.partial_hash in locations)
+            new_images = [i for i in new_images if i.partial_hash not in locations]
+            ImgLoader.execute_exist_images(exist_images, queue, conn, locations)
+        # новые миниатюры коммитятся порциями по мере готовности
+        with engine.connect() as conn:
+            ImgLoader.execute_new_images(new_images, queue, conn, packed)
+
+    @staticmethod
+    def has_legacy_keys(conn: sqlalchemy.Connection) -> bool:
+        """
+        Остались ли строки файлов с прежним ключом sha256 (64 символа).
+        Новые такие строки не появляются, поэтому ответ False
+        запоминается до конца процесса.
+        """
+        if ImgLoader.legacy_keys is False:
+            return False
+        stmt = (
+            sqlalchemy.select(CacheTable.id)
+            .where(CacheTable.type != Static.folder_type)
+            .where(sqlalchemy.func.length(CacheTable.partial_hash) == 64)
+            .limit(1)
+        )
+        ImgLoader.legacy_keys = conn.execute(stmt).first() is not None
+        return ImgLoader.legacy_keys
+
+    @staticmethod
+    def migrate_legacy_keys(data_items: list[DataItem], conn: sqlalchemy.Connection):
+        """
+        Переносит строки cache с прежнего ключа (Utils.get_legacy_hash)
+        на новый partial_hash вместе с миниатюрой и рейтингом, чтобы
+        после смены функции ключа кэш не создавался заново.
+        Прежний ключ читает файл, поэтому он считается только для файлов,
+        которых нет в cache и для которых есть строка с прежним ключом
+        с теми же name, size и mod.
+        """
+        files = [
+            i
+            for i in data_items
+            if i.type_ != Static.folder_type and i.partial_hash
+        ]
+        if not files or not ImgLoader.has_legacy_keys(conn):
+            return
+        stmt = (
+            sqlalchemy.select(CacheTable.partial_hash)
+            .where(CacheTable.partial_hash.in_([i.partial_hash for i in files]))
+        )
+        exist = {i for i, in conn.execute(stmt)}
+        files = [i for i in files if i.partial_hash not in exist]
+        if not files:
+            return
+        stmt = (
+            sqlalchemy.select(CacheTable.name, CacheTable.size, CacheTable.mod)
+            .where(CacheTable.type != Static.folder_type)
+            .where(sqlalchemy.func.length(CacheTable.partial_hash) == 64)
+            .where(CacheTable.name.in_({i.filename for i in files}))
+        )
+        candidates = {tuple(i) for i in conn.execute(stmt)}
+        legacy: dict[str, DataItem] = {}
+        for i in files:
+            if (i.filename, i.size, i.mod) not in candidates:
+                continue
+            try:
+                legacy[Utils.get_legacy_hash(i.src)] = i
+            except OSError:
+                continue
+        if not legacy:
+            return
+        stmt = (
+            sqlalchemy.select(CacheTable.partial_hash, CacheTable.thumb_path)
+            .where(CacheTable.partial_hash.in_(legacy))
+        )
+        for legacy_hash, old_thumb_path in conn.execute(stmt).fetchall():
+            data_item = legacy[legacy_hash]
+            values = {CacheTable.partial_hash.name: data_item.partial_hash}
+            # миниатюры из ThumbPack не переносятся, место в строке то же
+            if old_thumb_path:
+                try:
+                    os.makedirs(os.path.dirname(data_item.thumb_path), exist_ok=True)
+                    os.replace(old_thumb_path, data_item.thumb_path)
+                    values[CacheTable.thumb_path.name] = data_item.thumb_path
+                except (OSError, TypeError):
+                    values[CacheTable.thumb_path.name] = None
+                    values[CacheTable.thumb_size.name] = None
+            # строку с новым ключом мог уже создать другой процесс
+            stmt = (
+                sqlalchemy.update(CacheTable.table)
+                .prefix_with("OR IGNORE")
+                .where(CacheTable.partial_hash == legacy_hash)
+                .values(values)
+            )
+            conn.execute(stmt)
+
+    @staticmethod
+    def get_pack_locations(
+        data_items: list[DataItem],
+        conn: sqlalchemy.Connection
+    ) -> dict[str, tuple[int, int, int]]:
+        """
+        Для DataItem без файла миниатюры ищет миниатюру в ThumbPack.
+        Возвращает partial_hash: (pack_id, pack_offset, pack_length).
+        """
+        if not data_items:
+            return {}
+        stmt = (
+            sqlalchemy.select(
+                CacheTable.partial_hash,
+                CacheTable.pack_id,
+                CacheTable.pack_offset,
+                CacheTable.pack_length
+            )
+            .where(CacheTable.partial_hash.in_([i.partial_hash for i in data_items]))
+            .where(CacheTable.pack_id.is_not(None))
+        )
+        return {
+            partial_hash: (pack_id, offset, length)
+            for partial_hash, pack_id, offset, length in conn.execute(stmt)
+        }
+
+    @staticmethod
+    def read_cached(data_item: DataItem, location: tuple | None) -> np.ndarray | None:
+        """
+        Миниатюра из ThumbPack, если location есть, иначе из файла thumb_path.
+        """
+        if location is None:
+            return Utils.read_thumb(data_item.thumb_path)
+        data = ThumbPack.read(*location)
+        if data is None:
+            return None
+        return Utils.decode_thumb(data)
+
+    @staticmethod
+    def read_cached_poster(data_item: DataItem, location: tuple | None, size: int) -> np.ndarray | None:
+        """
+        Постер видео (JPEG до Static.video_poster_size) для сетки:
+        Image.draft декодирует JPEG сразу в уменьшенном масштабе
+        (1/2, 1/4, 1/8), не меньше size, вместо полного декодирования.
+        """
+        if location is None:
+            src = data_item.thumb_path
+        else:
+            data = ThumbPack.read(*location)
+            if data is None:
+                return None
+            src = io.BytesIO(data)
+        try:
+            with Image.open(src) as img:
+                # draft берет масштаб, при котором обе стороны не меньше
+                # заданных, поэтому size задается по большей стороне
+                scale = size / max(img.size)
+                img.draft("RGB", (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+                return np.array(img.convert("RGB"))
+        except Exception as e:
+            print("system > multiprocess read poster error", e)
+            return None
 
     @staticmethod
     def set_ratings(
@@ -130,18 +375,34 @@ class ImgLoader:
         queue: Queue,
         conn: sqlalchemy.Connection
     ):
-        hashes = {i.partial_hash: i for i in data_items}
+        """
+        Рейтинги файлов и папок берутся из HashCache, в БД идет
+        один запрос только по промахам.
+        """
+        hashes: dict[str, DataItem] = {}
+        for i in data_items:
+            cached = HashCache.get(i.partial_hash)
+            if cached is None:
+                hashes[i.partial_hash] = i
+            else:
+                i.rating = cached[0]
+                queue.put(ThumbMsg(i.src, i.partial_hash, i.rating))
+        if not hashes:
+            return
         stmt = (
-            sqlalchemy.select(CacheTable.partial_hash, CacheTable.rating)
+            sqlalchemy.select(
+                CacheTable.partial_hash,
+                CacheTable.rating,
+                CacheTable.thumb_path
+            )
             .where(CacheTable.partial_hash.in_(hashes))
         )
         res = conn.execute(stmt).fetchall()
-        if not res:
-            return
-        for partial_hash, rating in res:
+        for partial_hash, rating, thumb_path in res:
+            HashCache.put(partial_hash, rating, thumb_path)
             data_item = hashes[partial_hash]
             data_item.rating = rating
-            queue.put(data_item)
+            queue.put(ThumbMsg(data_item.src, partial_hash, rating))
 
     @staticmethod
     def execute_svg_files(data_items: list[DataItem], queue: Queue):
@@ -150,39 +411,61 @@ class ImgLoader:
         for i in data_items:
             img_array = ImgUtils.read_img(i.src)
             img_array = ImgUtils.resize(img_array, 512)
-            i.img_array = img_array
-            queue.put(i)
+            queue.put(ThumbMsg(i.src, i.partial_hash, i.rating, img_array))
 
     @staticmethod
     def execute_exist_images(
         data_items: list[DataItem],
         queue: Queue,
-        conn: sqlalchemy.Connection
+        conn: sqlalchemy.Connection,
+        locations: dict[str, tuple[int, int, int]]
     ):
         if not data_items:
             return
         for i in data_items:
-            img_array = Utils.read_thumb(i.thumb_path)
-            i.img_array = img_array
-            queue.put(i)
+            location = locations.get(i.partial_hash)
+            if i.type_ in ImgUtils.ext_video:
+                img_array = ImgLoader.read_cached_poster(i, location, Static.max_thumb_size)
+            else:
+                img_array = ImgLoader.read_cached(i, location)
+            # постер видео крупнее миниатюры
+            if img_array is not None and max(img_array.shape[:2]) > Static.max_thumb_size:
+                img_array = ImgUtils.resize(img_array, Static.max_thumb_size)
+            queue.put(ThumbMsg(i.src, i.partial_hash, i.rating, img_array))
+        # одним запросом на всю пачку, last_read нужен для CacheLimiter
+        stmt = (
+            sqlalchemy.update(CacheTable.table)
+            .values(last_read=Utils.get_now())
+            .where(CacheTable.partial_hash.in_([i.partial_hash for i in data_items]))
+        )
+        Dbase.execute(conn, stmt)
 
     @staticmethod
     def execute_new_images(
         data_items: list[DataItem],
         queue: Queue,
-        conn: sqlalchemy.Connection
+        conn: sqlalchemy.Connection,
+        packed: bool
     ):
         if not data_items:
             return
         values = []
         now = Utils.get_now()
         for data_item in data_items:
-            img_array = ImgUtils.read_img(data_item.src)
-            img_array = ImgUtils.resize(img_array, Static.max_thumb_size)
-            data_item.img_array = img_array
-            os.makedirs(os.path.dirname(data_item.thumb_path), exist_ok=True)
-            Utils.write_thumb(data_item.thumb_path, img_array)
-            queue.put(data_item)
+            if data_item.type_ in ImgUtils.ext_video:
+                thumb_array = ImgUtils.read_thumb(data_item.src, Static.video_poster_size)
+                img_array = ImgUtils.resize(thumb_array, Static.max_thumb_size)
+            else:
+                img_array = ImgUtils.read_thumb(data_item.src, Static.max_thumb_size)
+                img_array = ImgUtils.resize(img_array, Static.max_thumb_size)
+                thumb_array = img_array
+            if packed:
+                thumb = ImgLoader.write_packed(thumb_array)
+            else:
+                thumb = ImgLoader.write_file(data_item.thumb_path, thumb_array)
+            queue.put(
+                ThumbMsg(data_item.src, data_item.partial_hash, data_item.rating, img_array)
+            )
             values.append({
                 CacheTable.name.name: data_item.filename,
                 CacheTable.type.name: data_item.type_,
@@ -192,20 +475,541 @@ class ImgLoader:
                 CacheTable.last_read.name: now,
                 CacheTable.rating.name: 0,
                 CacheTable.partial_hash.name: data_item.partial_hash,
-                CacheTable.thumb_path.name: data_item.thumb_path
+                **thumb,
             })
-        stmt = (
-            sqlalchemy.insert(CacheTable.table)
-            .values(values)
+            # процесс могут завершить в любой момент (прокрутка, смена папки),
+            # поэтому строки пишутся небольшими порциями, а не в конце
+            if len(values) >= ImgLoader.write_chunk:
+                ImgLoader.write_rows(values, conn)
+                values.clear()
+        ImgLoader.write_rows(values, conn)
+
+    @staticmethod
+    def write_file(thumb_path: str, thumb_array: np.ndarray) -> dict:
+        os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+        if Utils.write_thumb(thumb_path, thumb_array):
+            thumb_size = os.path.getsize(thumb_path)
+        else:
+            thumb_size = None
+        return {
+            CacheTable.thumb_path.name: thumb_path,
+            CacheTable.thumb_size.name: thumb_size,
+            CacheTable.pack_id.name: None,
+            CacheTable.pack_offset.name: None,
+            CacheTable.pack_length.name: None,
+        }
+
+    @staticmethod
+    def write_packed(thumb_array: np.ndarray) -> dict:
+        data = Utils.encode_thumb(thumb_array) if thumb_array is not None else None
+        if data:
+            pack_id, offset = ThumbPack.append(data)
+            length = len(data)
+        else:
+            pack_id, offset, length = None, None, None
+        return {
+            CacheTable.thumb_path.name: None,
+            CacheTable.thumb_size.name: length,
+            CacheTable.pack_id.name: pack_id,
+            CacheTable.pack_offset.name: offset,
+            CacheTable.pack_length.name: length,
+        }
+
+    @staticmethod
+    def write_rows(values: list[dict], conn: sqlalchemy.Connection):
+        """
+        INSERT ... ON CONFLICT(partial_hash) DO UPDATE и коммит.
+        Если строка с таким partial_hash уже есть, обновляются данные
+        файла и миниатюры, а рейтинг остается прежним.
+        """
+        if not values:
+            return
+        stmt = sqlite.insert(CacheTable.table).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CacheTable.partial_hash],
+            set_={
+                i: stmt.excluded[i]
+                for i in (
+                    CacheTable.name.name,
+                    CacheTable.type.name,
+                    CacheTable.size.name,
+                    CacheTable.birth.name,
+                    CacheTable.mod.name,
+                    CacheTable.last_read.name,
+                    CacheTable.thumb_path.name,
+                    CacheTable.thumb_size.name,
+                    CacheTable.pack_id.name,
+                    CacheTable.pack_offset.name,
+                    CacheTable.pack_length.name,
+                )
+            }
         )
-        conn.execute(stmt)
+        Dbase.execute(conn, stmt)
+        Dbase.commit(conn)
+
+
+class _JobQueue:
+    """
+    Подменяет queue для ImgLoader.start внутри ThumbPool:
+    каждый результат уходит в общую очередь вместе с номером задания.
+    """
+    def __init__(self, result_queue: SimpleQueue, job_id: int):
+        self.result_queue = result_queue
+        self.job_id = job_id
+
+    def put(self, msg: ThumbMsg):
+        self.result_queue.put((self.job_id, msg))
+
+
+class _PoolWorker(BaseProcessWorker):
+    def __init__(self, target: callable, args: tuple):
+        self.job_queue = Queue()
+        self.ctrl_queue = Queue()
+        super().__init__(target, (*args, self.job_queue, self.ctrl_queue))
+        # общую очередь результатов закрывает ThumbPool.stop,
+        # процесс закрывает только свои очереди
+        self._queues = [self.job_queue, self.ctrl_queue]
+
+
+class ThumbPool:
+    """
+    Постоянный пул процессов для загрузки миниатюр (ImgLoader.start).
+    Процессы запускаются один раз и живут до выхода из приложения,
+    поэтому при прокрутке не тратится время на запуск процесса,
+    импорт cv2 / rawpy / tifffile / pillow_heif и создание движка БД.
+    Пул общий для всех сеток и окон.
+
+    Планировщик в GUI: каждая сетка регистрируется через register и при
+    прокрутке передает в schedule нужные ей DataItem с приоритетом
+    (расстояние до видимой области). schedule заменяет все ожидающие
+    DataItem этой сетки, так что ушедшие из видимой области отбрасываются.
+    Из общей очереди с приоритетом (heapq) в процессы уходят задания
+    по job_size DataItem, одновременно не больше max_in_flight заданий,
+    поэтому процессы не заняты тем, что уже не видно, а холодная папка
+    все равно декодируется на всех ядрах.
+    Задание уходит в очередь наименее занятого процесса, так что
+    известно, какие задания пропали, если процесс упал: их DataItem
+    снова ставятся в очередь.
+    Результаты приходят по одному ThumbMsg в порядке готовности,
+    on_result (QueueNotifier в GUI) передает их в callback сетки, в конце задания
+    приходит (job_id, None) и вызывается finished со списком DataItem.
+    После каждого задания процесс присылает (None, счетчики HashCache),
+    сумму по всем процессам возвращает get_cache_stats.
+
+    У каждого процесса свои очереди заданий и управления: во вторую
+    пересылаются изменения HashCache из GUI и отмена заданий.
+    """
+    size = max(1, (os.cpu_count() or 2) - 1)
+    job_size = 8
+    max_in_flight = size * 2
+    # процесс проверяет, жив ли GUI, раз в get_timeout секунд
+    get_timeout = 1
+
+    # SimpleQueue пишет в pipe сразу в put, без фонового потока Queue:
+    # результаты, отправленные до падения процесса, не теряются,
+    # иначе в упавшем задании были бы виноваты уже загруженные DataItem
+    result_queue: SimpleQueue = None
+    workers: list[_PoolWorker] = []
+    # owner_id: (callback, finished)
+    owners: dict[int, tuple[callable, callable]] = {}
+    # heap из (priority, seq, owner_id, DataItem)
+    pending: list[tuple] = []
+    # job_id: (owner_id, list[DataItem], процесс, priority первого DataItem)
+    in_flight: dict[int, tuple[int, list[DataItem], _PoolWorker, tuple]] = {}
+    # src DataItem из заданий упавших процессов, повторно не загружаются
+    crashed: set[str] = set()
+    # pid процесса: HashCache.get_stats этого процесса
+    cache_stats: dict[int, dict] = {}
+    _owner_id = 0
+    _job_id = 0
+    _seq = 0
+    _result_notifier: QueueNotifier = None
+
+    @classmethod
+    def start(cls):
+        if cls.workers:
+            return
+        cls.result_queue = SimpleQueue()
+        cls.workers = [cls._new_worker() for _ in range(cls.size)]
+        HashCache.listeners.append(cls.broadcast)
+        cls._result_notifier = QueueNotifier(cls.result_queue, cls.on_result)
+
+    @classmethod
+    def _new_worker(cls):
+        worker = _PoolWorker(
+            target=ThumbPool.worker,
+            args=(cls.result_queue, os.getpid())
+        )
+        worker.connect_finished(lambda: cls.on_worker_finished(worker))
+        worker.start()
+        return worker
+
+    @classmethod
+    def stop(cls):
+        if not cls.workers:
+            return
+        cls._result_notifier.stop()
+        if cls.broadcast in HashCache.listeners:
+            HashCache.listeners.remove(cls.broadcast)
+        for i in cls.workers:
+            i.terminate_join()
+        cls.result_queue.close()
+        cls.workers.clear()
+        cls.owners.clear()
+        cls.pending.clear()
+        cls.in_flight.clear()
+        cls.crashed.clear()
+        cls.cache_stats.clear()
+
+    @classmethod
+    def register(cls, callback: callable, finished: callable) -> int:
+        """
+        callback(msg: ThumbMsg) вызывается в GUI для каждого результата.
+        finished(data_items) вызывается, когда задание с этими DataItem
+        полностью обработано.
+        Возвращает owner_id для schedule и cancel.
+        """
+        cls.start()
+        cls._owner_id += 1
+        cls.owners[cls._owner_id] = (callback, finished)
+        return cls._owner_id
+
+    @classmethod
+    def schedule(cls, owner_id: int, items: list[tuple[tuple, DataItem]]):
+        """
+        items: (priority, DataItem), меньше priority - раньше загрузка.
+        Заменяет все ожидающие DataItem владельца. Уже отправленные
+        в процессы DataItem не ставятся повторно.
+        """
+        if owner_id not in cls.owners:
+            return
+        in_flight = {
+            data_item.src
+            for owner, data_items, *_ in cls.in_flight.values()
+            if owner == owner_id
+            for data_item in data_items
+        }
+        pending = [i for i in cls.pending if i[2] != owner_id]
+        for priority, data_item in items:
+            if data_item.src in in_flight:
+                continue
+            cls._seq += 1
+            pending.append((priority, cls._seq, owner_id, data_item))
+        heapq.heapify(pending)
+        cls.pending = pending
+        cls.dispatch()
+
+    @classmethod
+    def cancel(cls, owner_id: int):
+        """
+        Владелец закрыт: ожидающие DataItem отбрасываются, задания,
+        которые еще в очереди, процессы пропустят.
+        """
+        if cls.owners.pop(owner_id, None) is None:
+            return
+        cls.pending = [i for i in cls.pending if i[2] != owner_id]
+        heapq.heapify(cls.pending)
+        for job_id, (owner, _, worker, _) in list(cls.in_flight.items()):
+            if owner == owner_id:
+                cls.in_flight.pop(job_id)
+                worker.ctrl_queue.put(("cancel", job_id))
+        cls.dispatch()
+
+    @classmethod
+    def dispatch(cls):
+        """
+        Отправляет в процессы задания с наименьшим priority,
+        пока заданий в работе меньше max_in_flight.
+        Задание содержит DataItem только одного владельца и уходит
+        процессу, у которого меньше всего заданий в работе.
+        DataItem из заданий упавших процессов уходят по одному, чтобы
+        повторное падение было только на том DataItem, который его вызвал.
+        """
+        while cls.workers and cls.pending and len(cls.in_flight) < cls.max_in_flight:
+            priority, _, owner_id, data_item = heapq.heappop(cls.pending)
+            data_items = [data_item]
+            while cls.pending and len(data_items) < cls.job_size:
+                if data_item.src in cls.crashed:
+                    break
+                if cls.pending[0][2] != owner_id or cls.pending[0][-1].src in cls.crashed:
+                    break
+                data_items.append(heapq.heappop(cls.pending)[-1])
+            load = Counter(
+                worker
+                for *_, worker, _ in cls.in_flight.values()
+                if worker in cls.workers
+            )
+            worker = min(cls.workers, key=lambda x: load[x])
+            cls._job_id += 1
+            cls.in_flight[cls._job_id] = (owner_id, data_items, worker, priority)
+            # JsonData не передается в процессы, настройка идет с заданием
+            worker.job_queue.put((cls._job_id, data_items, JsonData.thumbs_packed))
+
+    @classmethod
+    def requeue(cls, owner_id: int, data_items: list[DataItem], priority: tuple, crashed: bool):
+        """
+        DataItem из задания упавшего процесса снова попадают в очередь.
+        crashed: процесс упал на этом задании. Если процесс уже падал
+        на таком DataItem, он считается загруженным без миниатюры,
+        иначе процессы падали бы по кругу.
+        """
+        if owner_id not in cls.owners:
+            return
+        if not crashed:
+            for data_item in data_items:
+                cls._seq += 1
+                heapq.heappush(cls.pending, (priority, cls._seq, owner_id, data_item))
+            return
+        retry = [i for i in data_items if i.src not in cls.crashed]
+        failed = [i for i in data_items if i.src in cls.crashed]
+        for data_item in retry:
+            cls.crashed.add(data_item.src)
+            cls._seq += 1
+            heapq.heappush(cls.pending, (priority, cls._seq, owner_id, data_item))
+        if failed:
+            callback, finished = cls.owners[owner_id]
+            try:
+                finished(failed)
+            except Exception as e:
+                print("system > multiprocess ThumbPool callback error", e)
+
+    @classmethod
+    def broadcast(cls, action: str, *args):
+        for i in cls.workers:
+            i.ctrl_queue.put((action, *args))
+
+    @classmethod
+    def on_worker_finished(cls, worker: _PoolWorker):
+        """
+        Процесс упал в декодере: его задания снова ставятся в очередь,
+        задания других процессов продолжаются.
+        """
+        if worker not in cls.workers:
+            return
+        # упавший процесс убирается из пула сразу, чтобы dispatch
+        # во время чтения результатов не отправлял ему задания
+        ind = cls.workers.index(worker)
+        cls.workers.pop(ind)
+        worker.terminate_join()
+        # результаты, которые процесс успел отправить: завершенные им
+        # задания уходят из in_flight как обычно
+        cls._result_notifier.read()
+        jobs = sorted(
+            job_id
+            for job_id, (*_, job_worker, _) in cls.in_flight.items()
+            if job_worker is worker
+        )
+        for job_id in jobs:
+            owner_id, data_items, _, priority = cls.in_flight.pop(job_id)
+            # очередь процесса FIFO: он упал на самом раннем задании,
+            # остальные еще не начинались
+            cls.requeue(owner_id, data_items, priority, job_id == jobs[0])
+        cls.workers.insert(ind, cls._new_worker())
+        cls.dispatch()
+
+    @classmethod
+    def get_cache_stats(cls) -> dict:
+        """
+        {"hits", "misses", "size"} HashCache всех процессов пула.
+        hits и misses учитывают и упавшие процессы, size только живые.
+        """
+        live = {i.process.pid for i in cls.workers}
+        return {
+            "hits": sum(i["hits"] for i in cls.cache_stats.values()),
+            "misses": sum(i["misses"] for i in cls.cache_stats.values()),
+            "size": sum(
+                stats["size"]
+                for pid, stats in cls.cache_stats.items()
+                if pid in live
+            ),
+        }
+
+    @classmethod
+    def on_result(cls, result: tuple[int | None, ThumbMsg | dict | None]):
+        job_id, msg = result
+        if job_id is None:
+            cls.cache_stats[msg["pid"]] = msg
+            return
+        job = cls.in_flight.get(job_id)
+        if job is None:
+            return
+        owner_id, data_items, *_ = job
+        callback, finished = cls.owners[owner_id]
+        try:
+            if msg is None:
+                cls.in_flight.pop(job_id)
+                cls.crashed.difference_update(i.src for i in data_items)
+                finished(data_items)
+            else:
+                callback(msg)
+        except Exception as e:
+            print("system > multiprocess ThumbPool callback error", e)
+        if msg is None:
+            cls.dispatch()
+
+    @staticmethod
+    def worker(result_queue: SimpleQueue, gui_pid: int, job_queue: Queue, ctrl_queue: Queue):
+        # при fork список слушателей GUI копируется в процесс
+        HashCache.listeners.clear()
+        cancelled: set[int] = set()
+        while True:
+            try:
+                job_id, data_items, packed = job_queue.get(timeout=ThumbPool.get_timeout)
+            except queue_module.Empty:
+                # GUI завершается через os._exit, сам процесс никто не остановит
+                if os.getppid() != gui_pid:
+                    return
+                continue
+            ThumbPool.apply_ctrl(ctrl_queue, cancelled)
+            skip = job_id in cancelled
+            # очередь процесса FIFO: задания с меньшими номерами уже разобраны
+            cancelled = {i for i in cancelled if i > job_id}
+            if skip:
+                continue
+            try:
+                ImgLoader.start(data_items, _JobQueue(result_queue, job_id), packed)
+            except Exception as e:
+                print("system > multiprocess ThumbPool error", e)
+            result_queue.put((job_id, None))
+            result_queue.put((None, {"pid": os.getpid(), **HashCache.get_stats()}))
+
+    @staticmethod
+    def apply_ctrl(ctrl_queue: Queue, cancelled: set[int]):
+        while not ctrl_queue.empty():
+            action, *args = ctrl_queue.get()
+            if action == "set_rating":
+                HashCache.set_rating(*args)
+            elif action == "clear":
+                HashCache.clear()
+                Dbase.dispose()
+                ThumbPack.close()
+            elif action == "cancel":
+                cancelled.add(*args)
+
+
+class SharedImg:
+    """
+    Передача пикселей из процесса в GUI через shared_memory вместо
+    pickle в Queue: процесс пишет массив в сегмент, в очередь уходит
+    только (shm_name, shape, dtype). GUI подключается к сегменту и
+    оборачивает его в QImage без копирования.
+
+    Имя сегмента выдает GUI (new_name) до запуска процесса, поэтому
+    GUI может удалить сегмент (discard), даже если процесс завершили
+    раньше, чем описание попало в очередь.
+    Процесс не удаляет сегмент при выходе, это делает GUI: сразу после
+    attach имя сегмента удаляется, память освобождается в release.
+    """
+    _counter = 0
+
+    def __init__(self, shm: shared_memory.SharedMemory, shape: tuple, dtype: str):
+        self.shm = shm
+        self.array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        self.qimage = Utils.qimage_from_array(self.array)
+
+    @classmethod
+    def new_name(cls) -> str:
+        # в macOS имя сегмента не длиннее 31 символа
+        cls._counter += 1
+        return f"pb{os.getpid()}_{cls._counter}"
+
+    @staticmethod
+    def put(shm_name: str, img_array: np.ndarray) -> tuple | None:
+        """
+        Вызывается в процессе. Возвращает описание для attach.
+        """
+        if img_array is None:
+            return None
+        img_array = np.ascontiguousarray(img_array)
+        try:
+            shm = shared_memory.SharedMemory(
+                shm_name, create=True, size=max(1, img_array.nbytes), track=False
+            )
+        except TypeError:
+            # до Python 3.13 resource_tracker удалил бы сегмент при выходе
+            # процесса, возможно раньше, чем GUI к нему подключится
+            shm = shared_memory.SharedMemory(
+                shm_name, create=True, size=max(1, img_array.nbytes)
+            )
+            resource_tracker.unregister(shm._name, "shared_memory")
+        dst = np.ndarray(img_array.shape, dtype=img_array.dtype, buffer=shm.buf)
+        dst[...] = img_array
+        del dst
+        shm.close()
+        return (shm_name, img_array.shape, img_array.dtype.str)
+
+    @classmethod
+    def attach(cls, desc: tuple) -> "SharedImg | None":
+        """
+        Вызывается в GUI. Имя сегмента сразу удаляется, память
+        остается, пока не вызван release.
+        """
+        shm_name, shape, dtype = desc
+        try:
+            shm = shared_memory.SharedMemory(shm_name)
+        except FileNotFoundError:
+            return None
+        shm.unlink()
+        return cls(shm, shape, dtype)
+
+    @staticmethod
+    def discard(shm_name: str):
+        """
+        Удаляет сегмент, к которому GUI не подключался.
+        """
+        try:
+            shm = shared_memory.SharedMemory(shm_name)
+        except FileNotFoundError:
+            return
+        shm.unlink()
+        shm.close()
+
+    def release(self):
+        # QImage и массив ссылаются на память сегмента
+        self.qimage = None
+        self.array = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # на память еще ссылаются, сегмент закроет сборщик мусора
+            pass
 
 
 class ReadImg:
     @staticmethod
-    def start(src: str, desaturate: bool, queue: Queue):
-        img_array = ImgUtils.read_img(src)
-        queue.put((src, img_array))
+    def start(src: str, desaturate: bool, shm_name: str, queue: Queue):
+        """
+        В queue уходит (src, описание SharedImg или None).
+        """
+        img_array = None
+        if src.endswith(ImgUtils.ext_video):
+            img_array = ReadImg.read_poster(src)
+        if img_array is None:
+            img_array = ImgUtils.read_img(src)
+        queue.put((src, SharedImg.put(shm_name, img_array)))
+
+    @staticmethod
+    def read_poster(src: str) -> np.ndarray | None:
+        """
+        Постер видео из кэша миниатюр (ImgLoader). Миниатюры видео,
+        созданные до появления постеров, слишком малы и не подходят.
+        """
+        data_item = DataItem(src)
+        data_item.set_properties()
+        data_item.set_hash_and_thumb_path()
+        if not data_item.thumb_path:
+            return None
+        location = None
+        if not os.path.exists(data_item.thumb_path):
+            with Dbase.create_engine().connect() as conn:
+                locations = ImgLoader.get_pack_locations([data_item], conn)
+            location = locations.get(data_item.partial_hash)
+            if location is None:
+                return None
+        img_array = ImgLoader.read_cached(data_item, location)
+        if img_array is None or max(img_array.shape[:2]) <= Static.max_thumb_size:
+            return None
+        return img_array
 
 
 class _DirChangedHandler(FileSystemEventHandler):
@@ -539,12 +1343,13 @@ class SearchTask:
 
         search_item.process_queue = process_queue
         search_item.gui_queue = gui_queue
-        search_item.missed_files = search_item.search_list
+        search_item.missed_files = list(search_item.search_list)
 
         SearchTask.setup(search_item)
 
         SearchTask.scandir_recursive(search_item)
-        search_item.process_queue.put(search_item)
+        # не найденные файлы уходят один раз, в конце поиска
+        search_item.process_queue.put(("missed", search_item.missed_files))
         Dbase.close_conn(search_item.conn)
 
     @staticmethod
@@ -591,16 +1396,18 @@ class SearchTask:
     def process_data_item(entry: os.DirEntry, search_item: SearchItem):
         # если мы нашли айтем из списка, то удаляем его из списка
         # не найденных айтемов
-        for i in search_item.missed_files:
-            if i.lower() in entry.name.lower():
-                search_item.missed_files.remove(i)
+        name = entry.name.lower()
+        search_item.missed_files = [
+            i
+            for i in search_item.missed_files
+            if i.lower() not in name
+        ]
 
         data_item = DataItem(entry.path)
         data_item.set_properties()
 
         if not entry.name.endswith(ImgUtils.ext_all):
-            data = (data_item, search_item.missed_files)
-            search_item.process_queue.put(data)
+            search_item.process_queue.put(("item", data_item.to_msg()))
             sleep(SearchTask.sleep_s)
             return
 
@@ -635,6 +1442,5 @@ class SearchTask:
         #     search_item.conn.execute(stmt)
         #     search_item.conn.commit()
         # data_item.img_array = img_array
-        data = (data_item, search_item.missed_files)
-        search_item.process_queue.put(data)
+        search_item.process_queue.put(("item", data_item.to_msg()))
         sleep(SearchTask.sleep_s)
@@ -3,7 +3,9 @@ import os
 import re
 import struct
 import subprocess
+import sys
 import tempfile
+import zlib
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -13,7 +15,7 @@ import pillow_heif
 import rawpy
 import rawpy._rawpy
 import tifffile
-from PIL import Image, ImageCms, ImageOps
+from PIL import ExifTags, Image, ImageCms, ImageOps
 
 
 class SharedUtils:
@@ -154,6 +156,27 @@ class ImgUtils:
         *ext_svg,
     )
 
+    # секунды, на которых ищется непустой кадр-постер видео
+    movie_poster_secs = (0, 1, 5)
+    blank_frame_mean = 12
+    blank_frame_std = 3
+
+    orientation_tag = 274
+    # IFD1: JPEGInterchangeFormat, JPEGInterchangeFormatLength
+    exif_thumb_offset_tag = 0x0201
+    exif_thumb_length_tag = 0x0202
+    # допустимое отличие пропорций превью от основного изображения
+    preview_ratio_tolerance = 0.02
+    orientation_methods = {
+        2: Image.Transpose.FLIP_LEFT_RIGHT,
+        3: Image.Transpose.ROTATE_180,
+        4: Image.Transpose.FLIP_TOP_BOTTOM,
+        5: Image.Transpose.TRANSPOSE,
+        6: Image.Transpose.ROTATE_270,
+        7: Image.Transpose.TRANSVERSE,
+        8: Image.Transpose.ROTATE_90,
+    }
+
     @classmethod
     def _get_broken_image(cls):
         path = Path("./images/broken_image.jpg")
@@ -163,22 +186,25 @@ class ImgUtils:
         return array_img
 
     @classmethod
-    def _read_tiff(cls, path: str):
+    def _process_tiff(cls, img: np.ndarray) -> np.ndarray:
+        if img.ndim == 3:
+            # Транспонируем, если каналы на первом месте
+            if min(img.shape) == img.shape[0]:
+                img = img.transpose(1, 2, 0)
+            # Ограничиваем количество каналов до 3
+            if img.shape[2] > 3:
+                img = img[:, :, :3]
+            # Преобразуем в uint8
+            if img.dtype != np.uint8:
+                img = (img / 256).astype(np.uint8)
+        elif img.ndim == 2:
+            if img.dtype != np.uint8:
+                img = (img / 256).astype(np.uint8)
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        return img
 
-        def process_image(img: np.ndarray) -> np.ndarray:
-            if img.ndim == 3:
-                # Транспонируем, если каналы на первом месте
-                if min(img.shape) == img.shape[0]:
-                    img = img.transpose(1, 2, 0)
-                # Ограничиваем количество каналов до 3
-                if img.shape[2] > 3:
-                    img = img[:, :, :3]
-                # Преобразуем в uint8
-                if img.dtype != np.uint8:
-                    img = (img / 256).astype(np.uint8)
-            elif img.ndim == 2:
-                img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-            return img
+    @classmethod
+    def _read_tiff(cls, path: str):
         readers = (
             lambda path: tifffile.imread(path, is_ome=False),
             lambda path: np.array(Image.open(path).convert("RGB")),
@@ -186,7 +212,7 @@ class ImgUtils:
         )
         for loader in readers:
             try:
-                return process_image(loader(path))
+                return cls._process_tiff(loader(path))
             except Exception as e:
                 print(f"read tiff error", path, e)
         return cls._get_broken_image()
@@ -223,6 +249,19 @@ class ImgUtils:
             
             return arr
 
+    @classmethod
+    def _read_psd(cls, path: str):
+        # qlmanage учитывает эффекты и смарт-объекты, но есть только на macOS
+        if sys.platform == "darwin":
+            return cls._read_quicklook(path)
+        try:
+            img = PsdReader.read(path)
+            if img is not None:
+                return img
+        except Exception as e:
+            print("read psd error", path, e)
+        return cls._get_broken_image()
+
     @classmethod
     def _read_icns(cls, path: str):
         return cls._read_png(path)
@@ -259,9 +298,14 @@ class ImgUtils:
             return cls._get_broken_image()
 
     @classmethod
-    def _read_jpg(cls, path: str):
+    def _read_jpg(cls, path: str, draft_size: int = None):
         try:
             img = Image.open(path)
+            if draft_size:
+                # JPEG декодируется сразу в 1/2, 1/4 или 1/8 размера (DCT),
+                # но не меньше draft_size по каждой стороне.
+                # Для остальных форматов draft ничего не делает
+                img.draft("RGB", (draft_size, draft_size))
             img = ImageOps.exif_transpose(img) 
             img = img.convert("RGB")
             array_img = np.array(img)
@@ -311,13 +355,38 @@ class ImgUtils:
             return cls._get_broken_image()
 
     @classmethod
-    def _read_movie(cls, path: str, time_sec=1):
+    def _is_blank_frame(cls, frame: np.ndarray) -> bool:
+        """
+        Черный или однотонный кадр (затемнение, титры на ровном фоне).
+        Проверяется по уменьшенной до 16x16 копии.
+        """
+        small = cv2.resize(frame, (16, 16), interpolation=cv2.INTER_AREA)
+        return small.mean() < cls.blank_frame_mean or small.std() < cls.blank_frame_std
+
+    @classmethod
+    def _read_movie(cls, path: str, size: int = None):
+        """
+        Кадр-постер. Первый кадр ключевой и читается без перемотки,
+        перемотка на movie_poster_secs нужна, только если он пустой.
+        size: кадр уменьшается до size по большей стороне сразу после
+        декодирования, до перевода в RGB.
+        """
         try:
             cap = cv2.VideoCapture(path)
-            cap.set(cv2.CAP_PROP_POS_MSEC, time_sec * 1000)
-            success, frame = cap.read()
+            frame = None
+            for sec in cls.movie_poster_secs:
+                if sec:
+                    cap.set(cv2.CAP_PROP_POS_MSEC, sec * 1000)
+                success, next_frame = cap.read()
+                if not success:
+                    break
+                if size and max(next_frame.shape[:2]) > size:
+                    next_frame = cls.resize(next_frame, size)
+                frame = next_frame
+                if not cls._is_blank_frame(frame):
+                    break
             cap.release()
-            if success:
+            if frame is not None:
                 frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
                 return frame
             else:
@@ -337,7 +406,7 @@ class ImgUtils:
         read_any_dict: dict[str, callable] = {}
 
         for i in cls.ext_psd:
-            read_any_dict[i] = cls._read_quicklook
+            read_any_dict[i] = cls._read_psd
         for i in cls.ext_tiff:
             read_any_dict[i] = cls._read_tiff
         for i in cls.ext_raw:
@@ -359,6 +428,119 @@ class ImgUtils:
         else:
             return cls._get_broken_image()
 
+    @classmethod
+    def _get_jpeg_preview(cls, path: str, size: int) -> Image.Image | None:
+        """
+        Превью из JPEG: дополнительные изображения MPF (камеры кладут туда
+        превью ~1920 px) и миниатюра EXIF (IFD1).
+        Берется наименьшее подходящее, поворот по EXIF основного изображения.
+        """
+        with Image.open(path) as img:
+            main_w, main_h = img.size
+            exif = img.getexif()
+            orientation = exif.get(cls.orientation_tag, 1)
+            candidates: list[Image.Image] = []
+
+            if img.format == "MPO":
+                for frame in range(1, img.n_frames):
+                    img.seek(frame)
+                    if max(img.size) >= size:
+                        img.draft("RGB", (size, size))
+                        candidates.append(img.copy())
+
+            ifd1 = exif.get_ifd(ExifTags.IFD.IFD1)
+            offset = ifd1.get(cls.exif_thumb_offset_tag)
+            length = ifd1.get(cls.exif_thumb_length_tag)
+            exif_data = img.info.get("exif", b"")
+            if offset and length and exif_data:
+                if exif_data.startswith(b"Exif\x00\x00"):
+                    exif_data = exif_data[6:]
+                thumb = Image.open(io.BytesIO(exif_data[offset:offset + length]))
+                if max(thumb.size) >= size:
+                    candidates.append(thumb)
+
+        # миниатюра с полями или другое изображение MPF (стерео) не подходят
+        main_ratio = main_w / main_h
+        candidates = [
+            i
+            for i in candidates
+            if abs(i.width / i.height - main_ratio) <= main_ratio * cls.preview_ratio_tolerance
+        ]
+        if not candidates:
+            return None
+        preview = min(candidates, key=lambda i: i.width)
+        method = cls.orientation_methods.get(orientation)
+        if method is not None:
+            preview = preview.transpose(method)
+        return preview
+
+    @classmethod
+    def _get_heif_preview(cls, path: str, size: int) -> Image.Image | None:
+        """
+        Миниатюры контейнера HEIF. libheif отдает их уже повернутыми.
+        """
+        heif_file = pillow_heif.open_heif(path)
+        heif_img = heif_file[heif_file.primary_index]
+        boxes = [
+            (box, index)
+            for index, box in enumerate(heif_img.info.get("thumbnails", []))
+            if box >= size
+        ]
+        if not boxes:
+            return None
+        _, index = min(boxes)
+        return heif_img.get_thumbnail(index).to_pillow()
+
+    @classmethod
+    def _read_preview(cls, path: str, size: int) -> np.ndarray | None:
+        """
+        Встроенное превью не меньше size по большей стороне.
+        Возвращает None, если подходящего превью нет.
+        """
+        try:
+            if path.lower().endswith((".heic", ".heif")):
+                img = cls._get_heif_preview(path, size)
+            else:
+                img = cls._get_jpeg_preview(path, size)
+            if img is None:
+                return None
+            return np.array(img.convert("RGB"))
+        except Exception as e:
+            print("read preview error", path, e)
+            return None
+
+    @classmethod
+    def read_thumb(cls, path: str, size: int) -> np.ndarray:
+        """
+        Чтение для миниатюр: сначала встроенное превью не меньше size
+        (MPF, EXIF, HEIF, ресурс миниатюры PSD, уровень пирамиды TIFF),
+        затем форматы, которые умеют отдавать уменьшенное изображение,
+        читаются сразу в размере не меньше size, остальные через read_img.
+        Просмотрщик читает через read_img.
+        """
+        _, ext = os.path.splitext(path)
+        ext = ext.lower()
+        if ext in cls.ext_jpeg:
+            img = cls._read_preview(path, size)
+            if img is not None:
+                return img
+            return cls._read_jpg(path, size)
+        if ext in cls.ext_video:
+            return cls._read_movie(path, size)
+        if ext in cls.ext_tiff:
+            try:
+                return cls._process_tiff(TiffReader.read_thumb(path, size))
+            except Exception as e:
+                print("read tiff thumb error", path, e)
+        if ext in cls.ext_psd:
+            try:
+                img = PsdReader.read_thumb(path, size)
+                if img is not None:
+                    return img
+            except Exception as e:
+                print("read psd thumb error", path, e)
+        return cls.read_img(path)
+
     @classmethod
     def get_psd_size(cls, path):
         with open(path, "rb") as f:
@@ -400,6 +582,323 @@ class ImgUtils:
             print("error profile read:", e)
         return None
 
+class PsdInfo:
+    def __init__(
+            self,
+            version: int,
+            channels: int,
+            height: int,
+            width: int,
+            depth: int,
+            color_mode: int,
+            resources_start: int,
+            resources_end: int,
+            image_data_start: int
+    ):
+        """
+        Заголовок PSD / PSB и смещения нужных секций файла.
+        version: 1 - PSD, 2 - PSB
+        """
+        super().__init__()
+        self.version = version
+        self.channels = channels
+        self.height = height
+        self.width = width
+        self.depth = depth
+        self.color_mode = color_mode
+        self.resources_start = resources_start
+        self.resources_end = resources_end
+        self.image_data_start = image_data_start
+
+
+class PsdReader:
+    """
+    Чтение PSD / PSB без qlmanage и без разбора слоев:
+    - миниатюра из ресурса 1036 (JPEG, обычно 160 px по большей стороне)
+    - сведенное изображение из секции image data (raw, RLE или ZIP).
+    Для миниатюры RLE декодируется только каждая step-я строка:
+    строки сжаты независимо и их длины записаны перед данными.
+    """
+    # 1036 - JPEG RGB, 1033 - то же, но BGR (Photoshop 4)
+    thumb_res_ids = (1036, 1033)
+    # во сколько раз больше size читается сведенное изображение
+    # перед resize, чтобы выборка строк и столбцов не давала ряби
+    oversample = 2
+    gray_mode = 1
+    rgb_mode = 3
+    cmyk_mode = 4
+
+    @classmethod
+    def read_info(cls, f) -> PsdInfo:
+        header = f.read(26)
+        if header[:4] != b"8BPS":
+            raise ValueError("Не PSD")
+        version, = struct.unpack(">H", header[4:6])
+        channels, height, width, depth, color_mode = struct.unpack(">HIIHH", header[12:26])
+
+        # color mode data
+        length, = struct.unpack(">I", f.read(4))
+        f.seek(length, 1)
+
+        # image resources
+        length, = struct.unpack(">I", f.read(4))
+        resources_start = f.tell()
+        resources_end = resources_start + length
+        f.seek(resources_end)
+
+        # layer and mask information, у PSB длина занимает 8 байт
+        length_fmt = ">I" if version == 1 else ">Q"
+        length, = struct.unpack(length_fmt, f.read(struct.calcsize(length_fmt)))
+        f.seek(length, 1)
+
+        return PsdInfo(
+            version=version,
+            channels=channels,
+            height=height,
+            width=width,
+            depth=depth,
+            color_mode=color_mode,
+            resources_start=resources_start,
+            resources_end=resources_end,
+            image_data_start=f.tell()
+        )
+
+    @classmethod
+    def read_thumb_res(cls, f, info: PsdInfo) -> Image.Image | None:
+        """
+        Ресурс миниатюры: 28 байт заголовка, затем JPEG.
+        """
+        f.seek(info.resources_start)
+        found: dict[int, bytes] = {}
+        while f.tell() + 12 <= info.resources_end:
+            f.read(4)  # сигнатура, обычно 8BIM
+            res_id, = struct.unpack(">H", f.read(2))
+            # имя - pascal строка, вместе с байтом длины выровнена до четного
+            name_len = f.read(1)[0]
+            f.seek(name_len + (name_len + 1) % 2, 1)
+            size, = struct.unpack(">I", f.read(4))
+            if res_id in cls.thumb_res_ids:
+                found[res_id] = f.read(size)
+                f.seek(size % 2, 1)
+            else:
+                f.seek(size + size % 2, 1)
+
+        for res_id in cls.thumb_res_ids:
+            data = found.get(res_id)
+            if not data or len(data) <= 28:
+                continue
+            res_format, = struct.unpack(">I", data[:4])
+            if res_format != 1:
+                continue
+            img = Image.open(io.BytesIO(data[28:])).convert("RGB")
+            if res_id == 1033:
+                r, g, b = img.split()
+                img = Image.merge("RGB", (b, g, r))
+            return img
+        return None
+
+    @staticmethod
+    def unpack_bits(data: bytes, size: int) -> bytes:
+        """
+        PackBits: n < 128 - следующие n + 1 байт как есть,
+        n > 128 - следующий байт 257 - n раз, 128 - ничего.
+        """
+        out = bytearray()
+        i = 0
+        data_len = len(data)
+        while i < data_len and len(out) < size:
+            n = data[i]
+            i += 1
+            if n < 128:
+                out += data[i:i + n + 1]
+                i += n + 1
+            elif n > 128:
+                out += data[i:i + 1] * (257 - n)
+                i += 1
+        return bytes(out[:size].ljust(size, b"\x00"))
+
+    @classmethod
+    def read_composite(cls, f, info: PsdInfo, step: int = 1) -> np.ndarray | None:
+        """
+        Сведенное изображение, каждая step-я строка и столбец.
+        Поддерживаются Grayscale, RGB, CMYK, 8 и 16 бит.
+        Возвращает None для остальных режимов и сжатия ZIP с предсказанием.
+        """
+        modes = {cls.gray_mode: 1, cls.rgb_mode: 3, cls.cmyk_mode: 4}
+        channels = modes.get(info.color_mode)
+        if channels is None or info.depth not in (8, 16) or info.channels < channels:
+            return None
+
+        bytes_per_sample = info.depth // 8
+        row_len = info.width * bytes_per_sample
+        rows = range(0, info.height, step)
+
+        f.seek(info.image_data_start)
+        compression, = struct.unpack(">H", f.read(2))
+        data_start = f.tell()
+        planes: list[list[bytes]] = [[] for _ in range(channels)]
+
+        if compression == 0:
+            for c in range(channels):
+                for y in rows:
+                    f.seek(data_start + (c * info.height + y) * row_len)
+                    planes[c].append(f.read(row_len))
+
+        elif compression == 1:
+            count_dtype = ">u2" if info.version == 1 else ">u4"
+            counts_len = info.channels * info.height * np.dtype(count_dtype).itemsize
+            counts = np.frombuffer(f.read(counts_len), dtype=count_dtype).astype(np.int64)
+            offsets = data_start + counts_len + np.concatenate(([0], np.cumsum(counts)[:-1]))
+            for c in range(channels):
+                for y in rows:
+                    row = c * info.height + y
+                    f.seek(int(offsets[row]))
+                    packed = f.read(int(counts[row]))
+                    planes[c].append(cls.unpack_bits(packed, row_len))
+
+        elif compression == 2:
+            data = zlib.decompress(f.read())
+            for c in range(channels):
+                for y in rows:
+                    start = (c * info.height + y) * row_len
+                    planes[c].append(data[start:start + row_len])
+
+        else:
+            return None
+
+        dtype = np.uint8 if bytes_per_sample == 1 else ">u2"
+        img = np.stack(
+            [
+                np.frombuffer(b"".join(plane), dtype=dtype).reshape(len(rows), info.width)
+                for plane in planes
+            ],
+            axis=-1
+        )[:, ::step]
+        if bytes_per_sample == 2:
+            img = (img >> 8).astype(np.uint8)
+
+        if info.color_mode == cls.gray_mode:
+            img = np.repeat(img, 3, axis=-1)
+        elif info.color_mode == cls.cmyk_mode:
+            # в PSD значения CMYK хранятся инвертированными: 255 - нет краски
+            cmy = img[:, :, :3].astype(np.uint16)
+            k = img[:, :, 3:4].astype(np.uint16)
+            img = (cmy * k // 255).astype(np.uint8)
+        return np.ascontiguousarray(img)
+
+    @classmethod
+    def read_thumb(cls, path: str, size: int) -> np.ndarray | None:
+        """
+        Миниатюра не меньше size: ресурс 1036, иначе сведенное
+        изображение через строку (step).
+        Сетка рисует миниатюру с dpr=2 (Utils.scaled), 170 px это 340
+        точек, поэтому миниатюра size уже растягивается. Ресурс меньше
+        size (обычно 160 px) растягивался бы еще сильнее и на Retina
+        выглядел бы размытым.
+        """
+        with open(path, "rb") as f:
+            info = cls.read_info(f)
+            thumb = cls.read_thumb_res(f, info)
+            if thumb is not None and max(thumb.size) >= size:
+                return np.array(thumb)
+            step = max(1, max(info.width, info.height) // (size * cls.oversample))
+            img = cls.read_composite(f, info, step)
+            if img is None and thumb is not None:
+                return np.array(thumb)
+            return img
+
+    @classmethod
+    def read(cls, path: str) -> np.ndarray | None:
+        with open(path, "rb") as f:
+            info = cls.read_info(f)
+            return cls.read_composite(f, info)
+
+
+class TiffReader:
+    """
+    Миниатюра TIFF без чтения всего изображения:
+    - наименьший уровень пирамиды (в том числе SubIFD) или reduced страница,
+    которые не меньше size по большей стороне
+    - иначе основная страница читается по тайлам (или полосам), каждый
+    сразу прореживается, так что память зависит от размера результата,
+    а не исходника.
+    """
+    # во сколько раз больше size читается страница перед resize
+    oversample = 2
+    # сколько первых страниц проверяется на reduced
+    max_pages = 16
+    # сколько байт файла tifffile читает за раз при чтении по тайлам
+    buffersize = 16 * 1024 * 1024
+    # допустимое отличие пропорций уровня от основного изображения
+    ratio_tolerance = 0.02
+
+    @staticmethod
+    def get_size(shape: tuple, axes: str) -> tuple[int, int]:
+        return shape[axes.index("X")], shape[axes.index("Y")]
+
+    @classmethod
+    def read_thumb(cls, path: str, size: int) -> np.ndarray:
+        with tifffile.TiffFile(path) as tif:
+            series = tif.series[0]
+            main_w, main_h = cls.get_size(series.shape, series.axes)
+            main_ratio = main_w / main_h
+
+            # (ширина, высота, чтение)
+            candidates: list[tuple[int, int, callable]] = []
+            for level in series.levels[1:]:
+                w, h = cls.get_size(level.shape, level.axes)
+                candidates.append((w, h, level.asarray))
+            for page in tif.pages[:cls.max_pages]:
+                if page.is_reduced:
+                    candidates.append((page.imagewidth, page.imagelength, page.asarray))
+
+            candidates = [
+                i
+                for i in candidates
+                if max(i[0], i[1]) >= size
+                and abs(i[0] / i[1] - main_ratio) <= main_ratio * cls.ratio_tolerance
+            ]
+            if candidates:
+                *_, read = min(candidates, key=lambda i: i[0])
+                return read()
+            return cls.read_downsampled(series.pages[0], size)
+
+    @classmethod
+    def read_downsampled(cls, page: tifffile.TiffPage, size: int) -> np.ndarray:
+        """
+        Каждая step-я строка и столбец страницы, тайл за тайлом.
+        """
+        w, h = page.imagewidth, page.imagelength
+        step = max(1, max(w, h) // (size * cls.oversample))
+        # planarconfig 2: каждый канал хранится отдельно, читаем целиком
+        if step == 1 or page.planarconfig != 1:
+            return page.asarray()
+
+        out: np.ndarray = None
+        segments = page.segments(maxworkers=1, buffersize=cls.buffersize)
+        for segment, (_, _, y, x, _), _ in segments:
+            if segment is None:
+                continue
+            # (глубина, строки, столбцы, каналы)
+            segment = segment[0]
+            dy = (-y) % step
+            dx = (-x) % step
+            if out is None:
+                out_shape = (-(-h // step), -(-w // step), segment.shape[-1])
+                out = np.zeros(out_shape, dtype=segment.dtype)
+            oy = (y + dy) // step
+            ox = (x + dx) // step
+            # крайние тайлы выходят за границы изображения
+            part = segment[dy::step, dx::step][:out.shape[0] - oy, :out.shape[1] - ox]
+            out[oy:oy + part.shape[0], ox:ox + part.shape[1]] = part
+
+        if out is None:
+            return page.asarray()
+        if out.shape[-1] == 1:
+            out = out[:, :, 0]
+        return out
+
+
 class PathFinder:
     def __init__(self, input_path: str):
         super().__init__()
@@ -7,15 +7,16 @@ import subprocess
 import traceback
 import zipfile
 
-import numpy as np
 import sqlalchemy
+from sqlalchemy.dialects import sqlite
 from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
 from PyQt5.QtGui import QImage
 
-from cfg import Dynamic, Static
-from system.shared_utils import ImgUtils, SharedUtils
+from cfg import Dynamic, JsonData, Static
+from system.shared_utils import SharedUtils
 
-from .database import CacheTable, Dbase
+from .database import (CacheTable, Dbase, HashCache, HashMemo,
+                       HashMemoTable, ThumbPack)
 from .items import DataItem, DirItem
 from .utils import Utils
 
@@ -79,6 +80,9 @@ class RatingTask(URunnable):
         finished_ = pyqtSignal()
 
     def __init__(self, main_dir: str, data_item: DataItem, new_rating: int):
+        """
+        Испускает finished_, только если рейтинг записан в БД.
+        """
         super().__init__()
         self.data_item = data_item
         self.new_rating = new_rating
@@ -87,17 +91,97 @@ class RatingTask(URunnable):
 
     def task(self):
         with Dbase.main_engine.begin() as conn:
-            stmt = (
-                sqlalchemy.update(CacheTable.table)
-                .values(rating=self.new_rating)
-            )
-            if self.data_item.type_ == Static.folder_type:
-                stmt = stmt.where(*DataItem.get_folder_conds(self.data_item))
-            else:
-                stmt = stmt.where(CacheTable.partial_hash==self.data_item.partial_hash)
-            conn.execute(stmt)
+            hashes = RatingTask.get_hashes(conn, [self.data_item])
+            if not hashes:
+                return
+            RatingTask.upsert_ratings(conn, hashes, self.new_rating)
+        HashCache.set_rating(hashes[0][1], self.new_rating)
         self.sigs.finished_.emit()
 
+    @staticmethod
+    def get_hashes(
+        conn: sqlalchemy.Connection,
+        data_items: list[DataItem]
+    ) -> list[tuple[DataItem, str]]:
+        """
+        Возвращает (DataItem, partial_hash). У файла, миниатюра которого
+        еще не загружена, partial_hash считается здесь же, DataItem
+        из GUI при этом не меняется. Файлы, которые не удалось прочитать,
+        пропускаются.
+        """
+        HashMemo.load(conn, [i.src for i in data_items if i.stat_key and not i.partial_hash])
+        hashes = []
+        for i in data_items:
+            try:
+                hashes.append((i, i.partial_hash or i.calc_partial_hash()))
+            except Exception as e:
+                print("tasks, RatingTask hash error", e)
+        HashMemo.save(conn)
+        return hashes
+
+    @staticmethod
+    def upsert_ratings(
+        conn: sqlalchemy.Connection,
+        hashes: list[tuple[DataItem, str]],
+        new_rating: int
+    ):
+        """
+        hashes: (DataItem, partial_hash), см. get_hashes.
+        INSERT ... ON CONFLICT(partial_hash) DO UPDATE одним executemany:
+        если строки еще нет (папка или файл без миниатюры), она создается,
+        иначе меняется только рейтинг.
+        """
+        now = Utils.get_now()
+        values = [
+            {
+                CacheTable.name.name: i.filename,
+                CacheTable.type.name: i.type_,
+                CacheTable.size.name: i.size,
+                CacheTable.birth.name: i.birth,
+                CacheTable.mod.name: i.mod,
+                CacheTable.last_read.name: now,
+                CacheTable.rating.name: new_rating,
+                CacheTable.partial_hash.name: partial_hash,
+            }
+            for i, partial_hash in hashes
+        ]
+        stmt = sqlite.insert(CacheTable.table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CacheTable.partial_hash],
+            set_={CacheTable.rating.name: stmt.excluded.rating}
+        )
+        conn.execute(stmt, values)
+
+
+class MultipleRatingTask(URunnable):
+
+    class Sigs(QObject):
+        finished_ = pyqtSignal(list)
+
+    def __init__(self, main_dir: str, data_items: list[DataItem], new_rating: int):
+        """
+        Записывает рейтинг сразу для списка DataItem (файлы и папки)
+        одним executemany в одной транзакции, см. RatingTask.upsert_ratings.
+        partial_hash файлов, миниатюры которых еще не загружены,
+        считается в задаче (RatingTask.get_hashes).
+        Испускает finished_ со списком обновленных DataItem.
+        """
+        super().__init__()
+        self.data_items = data_items
+        self.new_rating = new_rating
+        self.main_dir = main_dir
+        self.sigs = MultipleRatingTask.Sigs()
+
+    def task(self):
+        with Dbase.main_engine.begin() as conn:
+            hashes = RatingTask.get_hashes(conn, self.data_items)
+            if hashes:
+                RatingTask.upsert_ratings(conn, hashes, self.new_rating)
+
+        for i, partial_hash in hashes:
+            HashCache.set_rating(partial_hash, self.new_rating)
+        self.sigs.finished_.emit([i for i, _ in hashes])
+
 
 class FileRemover(URunnable):
 
@@ -133,33 +217,446 @@ class RevealFiles(URunnable):
 
 
 class DataSizeCounter(URunnable):
-    
+
     class Sigs(QObject):
         finished_ = pyqtSignal(dict)
 
-    def __init__(self):
+    def __init__(self, recalc: bool = False):
+        """
+        Возвращает {"total": байты, "count": кол-во миниатюр}
+        из счетчиков thumbs_stats.
+        recalc: заново узнать размер каждой миниатюры на диске
+        и пересчитать счетчики. Долго на большом кэше.
+        """
         super().__init__()
         self.sigs = DataSizeCounter.Sigs()
+        self.recalc = recalc
 
     def task(self):
         try:
-            self.sigs.finished_.emit(self.get_hashdir_size())
+            self.sigs.finished_.emit(self.get_stats())
         except Exception as e:
             print("tasks, DataSize error", e)
 
-    def get_hashdir_size(self):
-        total = 0
-        count = 0
-        stack = [Static.external_thumbs_dir]
-        while stack:
-            current = stack.pop()
-            for i in os.scandir(current):
-                if i.is_dir():
-                    stack.append(i.path)
-                elif i.name.endswith(ImgUtils.ext_all):
-                    total += os.path.getsize(i.path)
-                    count += 1
-        return {"total": total, "count": count}
+    def get_stats(self):
+        with Dbase.main_engine.begin() as conn:
+            if self.recalc:
+                last_id = 0
+                while last_id is not None:
+                    last_id = Dbase.fill_thumb_sizes(conn, False, last_id)
+                Dbase.sync_thumbs_stats(conn)
+            return Dbase.get_thumbs_stats(conn)
+
+
+class ThumbSizeFiller(URunnable):
+    """
+    Заполняет thumb_size у миниатюр, созданных до появления колонки:
+    без него счетчики thumbs_stats и CacheLimiter не видят эти миниатюры.
+    Каждая порция в своей транзакции, счетчики меняет триггер.
+    Если таких строк нет, задача делает один запрос.
+    """
+    batch = 500
+
+    def task(self):
+        try:
+            self.task_()
+        except Exception as e:
+            print("tasks, ThumbSizeFiller error", e)
+
+    def task_(self):
+        last_id = 0
+        while last_id is not None and self.is_should_run():
+            with Dbase.main_engine.begin() as conn:
+                last_id = Dbase.fill_thumb_sizes(conn, True, last_id, self.batch)
+
+
+class CacheLimiter(URunnable):
+    """
+    Удаляет миниатюры, которые дольше всех не читались (по last_read),
+    пока размер миниатюр по счетчикам thumbs_stats больше
+    JsonData.thumbs_limit_mb.
+    Миниатюры файлов с рейтингом не удаляются.
+    Миниатюры из ThumbPack удаляются только из БД, место в файлах
+    освобождает ThumbPackCompactor.
+    """
+    batch = 500
+
+    class Sigs(QObject):
+        finished_ = pyqtSignal(dict)
+
+    def __init__(self):
+        super().__init__()
+        self.sigs = CacheLimiter.Sigs()
+
+    def task(self):
+        try:
+            self.sigs.finished_.emit(self.task_())
+        except Exception as e:
+            print("tasks, CacheLimiter error", e)
+
+    def task_(self):
+        limit = JsonData.thumbs_limit_mb * pow(1024, 2)
+        removed = {"total": 0, "count": 0}
+        conn = Dbase.get_conn(Dbase.main_engine)
+        if conn is None:
+            return removed
+        try:
+            total = Dbase.get_thumbs_stats(conn)["total"]
+            # курсор (last_read, id) последней просмотренной строки:
+            # строки, чей файл не удалось удалить, остаются в БД,
+            # и следующая пачка начинается сразу после них
+            last_read, last_id = None, 0
+            while total > limit and self.is_should_run():
+                stmt = (
+                    sqlalchemy.select(
+                        CacheTable.id,
+                        CacheTable.last_read,
+                        CacheTable.partial_hash,
+                        CacheTable.thumb_path,
+                        CacheTable.thumb_size
+                    )
+                    .where(sqlalchemy.func.coalesce(CacheTable.rating, 0) == 0)
+                    .where(
+                        sqlalchemy.or_(
+                            CacheTable.thumb_path.is_not(None),
+                            CacheTable.pack_id.is_not(None)
+                        )
+                    )
+                    .where(self.after_cursor(last_read, last_id))
+                    .order_by(CacheTable.last_read, CacheTable.id)
+                    .limit(self.batch)
+                )
+                rows = conn.execute(stmt).fetchall()
+                if not rows:
+                    break
+                hashes = []
+                for id_, read, partial_hash, thumb_path, thumb_size in rows:
+                    last_read, last_id = read, id_
+                    try:
+                        if thumb_path is not None:
+                            os.remove(thumb_path)
+                    except FileNotFoundError:
+                        # строка удаляется, триггер уменьшит счетчики
+                        pass
+                    except OSError as e:
+                        # строка остается, чтобы файл не остался
+                        # без строки в БД
+                        print("CacheLimiter remove error", e)
+                        continue
+                    hashes.append(partial_hash)
+                    # в счетчиках учтены только строки с thumb_size
+                    size = thumb_size or 0
+                    total -= size
+                    removed["total"] += size
+                    removed["count"] += 1
+                    if total <= limit:
+                        break
+                stmt = (
+                    sqlalchemy.delete(CacheTable.table)
+                    .where(CacheTable.partial_hash.in_(hashes))
+                )
+                Dbase.execute(conn, stmt)
+                # без строки cache запись hash_memo только занимает место в БД
+                stmt = (
+                    sqlalchemy.delete(HashMemoTable.table)
+                    .where(HashMemoTable.partial_hash.in_(hashes))
+                )
+                Dbase.execute(conn, stmt)
+                Dbase.commit(conn)
+        finally:
+            Dbase.close_conn(conn)
+        print("CacheLimiter: удалено миниатюр", removed["count"])
+        return removed
+
+    @staticmethod
+    def after_cursor(last_read: int | None, last_id: int):
+        """
+        Условие "строка идет после (last_read, id)" в порядке
+        ORDER BY last_read, id. В SQLite NULL идет раньше любых чисел.
+        """
+        if last_read is None:
+            return sqlalchemy.or_(
+                CacheTable.last_read.is_not(None),
+                CacheTable.id > last_id
+            )
+        return sqlalchemy.or_(
+            CacheTable.last_read > last_read,
+            sqlalchemy.and_(
+                CacheTable.last_read == last_read,
+                CacheTable.id > last_id
+            )
+        )
+
+
+class CacheReaper(URunnable):
+    """
+    Сверяет файлы миниатюр со строками cache и удаляет расхождения:
+    - файл без строки в БД удаляется
+    - строка без файла удаляется, если у нее нет рейтинга,
+      иначе у нее только обнуляется thumb_size
+    За один запуск проверяет shards_per_run папок-шардов (00 ... ff),
+    следующий запуск продолжает с места остановки.
+    Файлы шарда и строки БД идут отсортированными по пути и сравниваются
+    слиянием, без загрузки всего кэша в память.
+    """
+    shards_per_run = 16
+    # свежий файл может быть еще не записан в БД: ImgLoader пишет
+    # строки порциями после сохранения миниатюр
+    min_file_age_sec = 600
+    shards = [f"{i:02x}" for i in range(256)]
+
+    class Sigs(QObject):
+        finished_ = pyqtSignal(dict)
+
+    def __init__(self):
+        super().__init__()
+        self.sigs = CacheReaper.Sigs()
+        self.report = {"files": 0, "rows": 0, "rated_rows": 0, "shards": 0}
+
+    def task(self):
+        try:
+            self.task_()
+        except Exception as e:
+            print("tasks, CacheReaper error", e)
+        self.sigs.finished_.emit(self.report)
+
+    def task_(self):
+        for _ in range(self.shards_per_run):
+            if not self.is_should_run():
+                break
+            ind = JsonData.cache_check_shard % len(self.shards)
+            with Dbase.main_engine.begin() as conn:
+                self.check_shard(self.shards[ind], conn)
+            JsonData.cache_check_shard = (ind + 1) % len(self.shards)
+            self.report["shards"] += 1
+        if self.report["files"] or self.report["rows"] or self.report["rated_rows"]:
+            print("CacheReaper:", self.report)
+
+    def iter_files(self, shard: str):
+        shard_dir = os.path.join(Static.external_thumbs_dir, shard)
+        if not os.path.isdir(shard_dir):
+            return
+        entries = [
+            i
+            for i in os.scandir(shard_dir)
+            if i.is_file() and not i.name.startswith(".")
+        ]
+        entries.sort(key=lambda x: x.path)
+        yield from entries
+
+    def iter_rows(self, shard: str, conn: sqlalchemy.Connection):
+        # partial_hash в hex, следующий после "xx" шард
+        # гарантированно больше любого хэша, который начинается на "xx"
+        upper = shard[0] + chr(ord(shard[1]) + 1)
+        stmt = (
+            sqlalchemy.select(
+                CacheTable.id,
+                CacheTable.thumb_path,
+                CacheTable.rating
+            )
+            .where(CacheTable.partial_hash >= shard)
+            .where(CacheTable.partial_hash < upper)
+            .where(CacheTable.thumb_path.is_not(None))
+            .order_by(CacheTable.thumb_path)
+        )
+        yield from conn.execute(stmt)
+
+    def check_shard(self, shard: str, conn: sqlalchemy.Connection):
+        now = Utils.get_now()
+        files = self.iter_files(shard)
+        rows = self.iter_rows(shard, conn)
+        orphan_files: list[str] = []
+        orphan_rows: list[int] = []
+        orphan_rated_rows: list[int] = []
+
+        file = next(files, None)
+        row = next(rows, None)
+        while file is not None or row is not None:
+            if row is None or (file is not None and file.path < row.thumb_path):
+                if now - file.stat().st_mtime > self.min_file_age_sec:
+                    orphan_files.append(file.path)
+                file = next(files, None)
+            elif file is None or row.thumb_path < file.path:
+                if row.rating:
+                    orphan_rated_rows.append(row.id)
+                else:
+                    orphan_rows.append(row.id)
+                row = next(rows, None)
+            else:
+                file = next(files, None)
+                row = next(rows, None)
+
+        for i in orphan_files:
+            try:
+                os.remove(i)
+                self.report["files"] += 1
+            except OSError as e:
+                print("CacheReaper remove error", e)
+        if orphan_rows:
+            stmt = (
+                sqlalchemy.delete(CacheTable.table)
+                .where(CacheTable.id.in_(orphan_rows))
+            )
+            conn.execute(stmt)
+            self.report["rows"] += len(orphan_rows)
+        if orphan_rated_rows:
+            # рейтинг остается, миниатюру ImgLoader создаст заново
+            stmt = (
+                sqlalchemy.update(CacheTable.table)
+                .where(CacheTable.id.in_(orphan_rated_rows))
+                .where(CacheTable.thumb_size.is_not(None))
+                .values(thumb_size=None)
+            )
+            res = conn.execute(stmt)
+            self.report["rated_rows"] += res.rowcount
+
+
+class ThumbPackCompactor(URunnable):
+    """
+    Освобождает место в файлах ThumbPack:
+    - файл без живых миниатюр удаляется
+    - файл, где живых миниатюр меньше min_live_ratio от размера файла,
+      переписывается: живые миниатюры дописываются в новый файл,
+      строки cache переносятся на новое место, старый файл удаляется
+    - строка, чей файл пропал, удаляется, если у нее нет рейтинга,
+      иначе у нее обнуляется место миниатюры
+    Файлы, открытые на запись (ThumbPack.is_locked) или недавно
+    измененные, не трогаются.
+    """
+    min_live_ratio = 0.5
+    # ImgLoader пишет строки порциями уже после записи в файл,
+    # последние строки закрытого файла могут быть еще не в БД
+    min_pack_age_sec = 600
+
+    class Sigs(QObject):
+        finished_ = pyqtSignal(dict)
+
+    def __init__(self):
+        super().__init__()
+        self.sigs = ThumbPackCompactor.Sigs()
+        self.report = {"removed": 0, "rewritten": 0, "freed": 0, "rows": 0}
+
+    def task(self):
+        try:
+            self.task_()
+        except Exception as e:
+            print("tasks, ThumbPackCompactor error", e)
+        finally:
+            # новый файл не должен оставаться открытым на запись
+            ThumbPack.close()
+        self.sigs.finished_.emit(self.report)
+
+    def task_(self):
+        with Dbase.main_engine.begin() as conn:
+            self.remove_orphan_rows(conn)
+        for pack_id in ThumbPack.get_pack_ids():
+            if not self.is_should_run():
+                break
+            if ThumbPack.is_locked(pack_id):
+                continue
+            try:
+                mtime = os.path.getmtime(ThumbPack.get_path(pack_id))
+            except OSError:
+                continue
+            if Utils.get_now() - mtime < self.min_pack_age_sec:
+                continue
+            with Dbase.main_engine.connect() as conn:
+                self.check_pack(pack_id, conn)
+        if any(self.report.values()):
+            print("ThumbPackCompactor:", self.report)
+
+    def remove_orphan_rows(self, conn: sqlalchemy.Connection):
+        stmt = (
+            sqlalchemy.select(CacheTable.pack_id)
+            .where(CacheTable.pack_id.is_not(None))
+            .distinct()
+        )
+        pack_ids = [i for i, in conn.execute(stmt)]
+        # файл создается до того, как строки попадут в БД
+        missing = [i for i in pack_ids if not os.path.exists(ThumbPack.get_path(i))]
+        if missing:
+            self.drop_rows(CacheTable.pack_id.in_(missing), conn)
+
+    def drop_rows(self, where: sqlalchemy.ColumnElement, conn: sqlalchemy.Connection):
+        stmt = (
+            sqlalchemy.delete(CacheTable.table)
+            .where(where)
+            .where(sqlalchemy.func.coalesce(CacheTable.rating, 0) == 0)
+        )
+        self.report["rows"] += conn.execute(stmt).rowcount
+        # рейтинг остается, миниатюру ImgLoader создаст заново
+        stmt = (
+            sqlalchemy.update(CacheTable.table)
+            .where(where)
+            .values(pack_id=None, pack_offset=None, pack_length=None, thumb_size=None)
+        )
+        conn.execute(stmt)
+
+    def check_pack(self, pack_id: int, conn: sqlalchemy.Connection):
+        path = ThumbPack.get_path(pack_id)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        stmt = (
+            sqlalchemy.select(
+                CacheTable.id,
+                CacheTable.pack_offset,
+                CacheTable.pack_length
+            )
+            .where(CacheTable.pack_id == pack_id)
+            .order_by(CacheTable.pack_offset)
+        )
+        rows = conn.execute(stmt).fetchall()
+        live = sum(i.pack_length for i in rows)
+        if rows and live >= size * self.min_live_ratio:
+            return
+        values = []
+        lost = []
+        for id_, offset, length in rows:
+            data = ThumbPack.read(pack_id, offset, length)
+            if data is None:
+                # файл обрезан, например запись прервалась
+                lost.append(id_)
+                continue
+            new_pack_id, new_offset = ThumbPack.append(data)
+            values.append({
+                "b_id": id_,
+                "b_old_offset": offset,
+                "b_length": length,
+                "b_pack": new_pack_id,
+                "b_offset": new_offset
+            })
+        if lost:
+            self.drop_rows(CacheTable.id.in_(lost), conn)
+        if values:
+            # пока данные копировались, процесс мог записать миниатюру
+            # заново в другое место: такая строка не совпадет и не изменится,
+            # ее копия в новом файле останется мусором до следующего сжатия
+            stmt = (
+                sqlalchemy.update(CacheTable.table)
+                .where(CacheTable.id == sqlalchemy.bindparam("b_id"))
+                .where(CacheTable.pack_id == pack_id)
+                .where(CacheTable.pack_offset == sqlalchemy.bindparam("b_old_offset"))
+                .where(CacheTable.pack_length == sqlalchemy.bindparam("b_length"))
+                .values(
+                    pack_id=sqlalchemy.bindparam("b_pack"),
+                    pack_offset=sqlalchemy.bindparam("b_offset")
+                )
+            )
+            conn.execute(stmt, values)
+            self.report["rewritten"] += 1
+        else:
+            self.report["removed"] += 1
+        # строки должны указывать на новый файл раньше, чем пропадет старый,
+        # поэтому без Dbase.commit: ошибка коммита прерывает задачу
+        conn.commit()
+        ThumbPack.forget(pack_id)
+        try:
+            os.remove(path)
+            self.report["freed"] += size - live
+        except OSError as e:
+            print("ThumbPackCompactor remove error", e)
 
 
 class CacheCleaner(URunnable):
@@ -172,8 +669,14 @@ class CacheCleaner(URunnable):
         self.sigs = CacheCleaner.Sigs()
 
     def task(self):
+        ThumbPack.close()
         shutil.rmtree(Static.external_thumbs_dir)
-        os.remove(Static.external_db)
+        Dbase.dispose()
+        HashCache.clear()
+        # в режиме WAL рядом с БД лежат файлы -wal и -shm
+        for i in ("", "-wal", "-shm"):
+            if os.path.exists(Static.external_db + i):
+                os.remove(Static.external_db + i)
         os.makedirs(Static.external_thumbs_dir)
         with open(Static.external_db, "w"):
             pass
@@ -269,6 +772,8 @@ class OnStartTask(URunnable):
         files = (
             "cfg.json",
             "db.db",
+            "db.db-wal",
+            "db.db-shm",
             "uti_icons",
             "log.txt",
             "servers.json",
@@ -342,19 +847,3 @@ class DirScaner(URunnable):
         Метод заглушка аналогично multiprocessing.Process.terminate()
         """
         ...
-
-
-class ImgArrayQImage(URunnable):
-    
-    class Sigs(QObject):
-        finished_ = pyqtSignal(QImage)
-
-    def __init__(self, img_array: np.ndarray):
-        super().__init__()
-        self.sigs = ImgArrayQImage.Sigs()
-        self.img_array = img_array
-
-    def task(self):
-        self.sigs.finished_.emit(
-            Utils.qimage_from_array(self.img_array)
-        )
\ No newline at end of file
@@ -1,5 +1,6 @@
 import hashlib
 import inspect
+import mmap
 import os
 import subprocess
 import traceback
@@ -16,6 +17,11 @@ from PyQt5.QtWidgets import QApplication
 from cfg import Dynamic, Static
 from system.shared_utils import ImgUtils
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 
 class Utils:
 
@@ -86,14 +92,87 @@ class Utils:
             return None
         return qimage
 
+    # начало и конец файла, по которым считается partial_hash
+    head_bytes = int(0.4 * (1 << 20))
+    tail_bytes = 64 * 1024
+    # на сетевых и внешних дисках mmap может упасть с SIGBUS,
+    # если файл укоротят во время чтения
+    mmap_excluded = ("/Volumes/", )
+
+    @classmethod
+    def get_content_key_funcs(cls) -> dict[str, callable]:
+        """
+        Функции ключа Static.content_key: имя -> новый объект хэша.
+        """
+        funcs = {
+            "sha256": hashlib.sha256,
+            "blake2b": lambda: hashlib.blake2b(digest_size=16),
+        }
+        if xxhash is not None:
+            funcs["xxh3"] = xxhash.xxh3_128
+        return funcs
+
     @classmethod
-    def get_partial_hash(cls, path: str, mb: float = 0.4) -> str:
+    def get_content_key(cls) -> str:
+        """
+        Имя функции, которой get_partial_hash считает ключ: Static.content_key
+        или sha256, если такой функции нет (например, не установлен xxhash).
+        """
+        if Static.content_key in cls.get_content_key_funcs():
+            return Static.content_key
+        return "sha256"
+
+    @classmethod
+    def get_partial_hash(cls, path: str) -> str:
+        """
+        Ключ содержимого файла для таблицы cache: хэш Static.content_key
+        от размера файла, первых head_bytes и последних tail_bytes.
+        Размер и конец файла отличают файлы с одинаковым заголовком.
+        Ключ 32 символа, так он не совпадает с прежним ключом на 64.
+        """
+        h = cls.get_content_key_funcs()[cls.get_content_key()]()
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            h.update(size.to_bytes(8, "little"))
+            tail_start = max(cls.head_bytes, size - cls.tail_bytes)
+            if size and not path.startswith(cls.mmap_excluded):
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    with memoryview(mm) as view:
+                        h.update(view[:cls.head_bytes])
+                        h.update(view[tail_start:])
+            else:
+                h.update(f.read(cls.head_bytes))
+                if size > tail_start:
+                    f.seek(tail_start)
+                    h.update(f.read())
+        return h.hexdigest()[:32]
+
+    @classmethod
+    def get_legacy_hash(cls, path: str, mb: float = 0.4) -> str:
+        """
+        Прежний partial_hash: sha256 первых 0.4 МБ файла.
+        Нужен только для переноса старых строк cache на новый ключ.
+        """
         chunk = int(mb * (1 << 20))  # переводим МБ в байты
         h = hashlib.sha256()
         with open(path, "rb") as f:
             h.update(f.read(chunk))
         return h.hexdigest()
 
+    @classmethod
+    def get_folder_hash(cls, filename: str, birth: int, src: str) -> str:
+        """
+        Ключ папки в таблице cache (вместо partial_hash файла).
+        Имя и дата создания не меняются при изменении содержимого папки
+        и при переподключении сетевого диска. Если дата создания неизвестна,
+        используется полный путь.
+        """
+        if birth:
+            key = f"{Static.folder_type}:{filename}:{birth}"
+        else:
+            key = f"{Static.folder_type}:{src}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
     @classmethod
     def get_abs_thumb_path(cls, partial_hash: str) -> str:
         base = os.path.join(
@@ -142,6 +221,50 @@ class Utils:
             print(f"read_thumb: ошибка чтения thumb: {e}")
             return None
 
+    @classmethod
+    def encode_thumb(cls, thumb_array: np.ndarray) -> bytes | None:
+        """
+        Как write_thumb, но возвращает байты jpg / png для ThumbPack.
+        """
+        try:
+            if len(thumb_array.shape) == 2:  # grayscale
+                ok, buf = cv2.imencode(".jpg", thumb_array)
+            elif thumb_array.shape[2] == 3:  # BGR
+                img = cv2.cvtColor(thumb_array, cv2.COLOR_BGR2RGB)
+                ok, buf = cv2.imencode(".jpg", img)
+            elif thumb_array.shape[2] == 4:  # BGRA (с альфой)
+                img = cv2.cvtColor(thumb_array, cv2.COLOR_BGRA2RGBA)
+                ok, buf = cv2.imencode(".png", img, [cv2.IMWRITE_PNG_COMPRESSION, 3])
+            else:
+                print(f"encode_thumb: неподдерживаемое число каналов {thumb_array.shape}")
+                return None
+            return buf.tobytes() if ok else None
+        except Exception as e:
+            print(f"encode_thumb: ошибка кодирования thumb: {e}")
+            return None
+
+    @classmethod
+    def decode_thumb(cls, data: bytes) -> np.ndarray | None:
+        """
+        Как read_thumb, но из байтов, прочитанных из ThumbPack.
+        """
+        try:
+            buf = np.frombuffer(data, dtype=np.uint8)
+            img = cv2.imdecode(buf, cv2.IMREAD_UNCHANGED)
+            if img is None:
+                return None
+            if len(img.shape) == 2:  # grayscale
+                return img
+            elif img.shape[2] == 3:  # BGR → RGB
+                return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            elif img.shape[2] == 4:  # BGRA → RGBA
+                return cv2.cvtColor(img, cv2.COLOR_BGRA2RGBA)
+            else:
+                return img
+        except Exception as e:
+            print(f"decode_thumb: ошибка декодирования thumb: {e}")
+            return None
+
         
     @classmethod
     def get_now(cls):
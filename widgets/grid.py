@@ -14,10 +14,11 @@ from watchdog.events import FileSystemEvent
 from cfg import Dynamic, JsonData, Static
 from system.appkit_icon import AppKitIcon
 from system.database import Dbase
-from system.items import ClipboardItem, DataItem, MainWinItem, SortItem
-from system.multiprocess import DirWatcher, ImgLoader, ProcessWorker
+from system.items import (ClipboardItem, DataItem, MainWinItem, SortItem,
+                          ThumbMsg)
+from system.multiprocess import DirWatcher, ProcessWorker, ThumbPool
 from system.shared_utils import ImgUtils, SharedUtils
-from system.tasks import RatingTask, UThreadPool
+from system.tasks import MultipleRatingTask, UThreadPool
 from system.utils import Utils
 
 from ._base_widgets import UMenu, UScrollArea
@@ -187,7 +188,7 @@ class Thumb(QFrame):
         appkit_icon.get_qimages()
 
     def set_image(self):
-        qimage = self.data_item.qimages[Thumb.current_image_size]
+        qimage = self.data_item.get_qimage(Thumb.current_image_size)
         pixmap = QPixmap.fromImage(qimage)
         self.img_wid.setPixmap(pixmap)
         self.data_item.image_is_loaded = True
@@ -265,7 +266,8 @@ class NoItemsLabel(QLabel):
 class Grid(UScrollArea):
     test = []
     spacing_value = 5
-    img_timer_ms = 500
+    # сколько экранов выше и ниже видимой области загружать заранее
+    prefetch_screens = 1
     new_files_key = "new_files"
     del_files_key = "del files"
     new_folder_text = "Новая папка"
@@ -308,8 +310,11 @@ class Grid(UScrollArea):
         self.copy_files_icon: QImage = self.set_files_icon()
 
         self.dir_watcher_task = None
-        self.proc_timer_dict: dict[ProcessWorker, QTimer] = {}
-        self.loaded_thumbs: list[Thumb] = []
+        self.thumb_owner = ThumbPool.register(
+            self.update_thumb,
+            self.update_thumbs_finished
+        )
+        self.loaded_thumbs: set[Thumb] = set()
 
         self.grid_wid = QWidget()
         self.setWidget(self.grid_wid)
@@ -330,34 +335,38 @@ class Grid(UScrollArea):
         qimage = Utils.render_svg(path, 512)
         return Utils.scaled(qimage, size)
 
-    def dirs_watcher_start(self, fast_ms=300, slow_ms=1000):
+    def dirs_watcher_start(self, fast_ms=50, slow_ms=1000):
+        """
+        События приходят сразу (ProcessWorker.connect_queue) и копятся
+        fast_ms, чтобы пачка событий сортировалась один раз.
+        Во время копирования файлов (ClipboardItem) пачка копится slow_ms.
+        """
 
-        def poll_task():
-            if ClipboardItem.src_urls:
-                ms = slow_ms
-            else:
-                ms = fast_ms
-            self.dir_watcher_timer.stop()
-            q = self.dir_watcher_task.process_queue
-            events: list[FileSystemEvent] = []
-            while not q.empty():
-                events.append(q.get())
-            for i in events:
-                QTimer.singleShot(0, lambda event=i: self.apply_changes(event))
-            self.dir_watcher_timer.start(ms)
-            QTimer.singleShot(0, self.sort_thumbs)
-            QTimer.singleShot(0, self.rearrange_thumbs)
+        def on_event(event: FileSystemEvent):
+            events.append(event)
+            if not self.dir_watcher_timer.isActive():
+                ms = slow_ms if ClipboardItem.src_urls else fast_ms
+                self.dir_watcher_timer.start(ms)
 
+        def apply_events():
+            for i in events:
+                self.apply_changes(i)
+            events.clear()
+            self.sort_thumbs()
+            self.rearrange_thumbs()
 
+        events: list[FileSystemEvent] = []
         self.dir_watcher_task = ProcessWorker(
             target=DirWatcher.start,
             args=(self.main_win_item.main_dir, )
         )
+        self.dir_watcher_task.connect_queue(
+            self.dir_watcher_task.process_queue, on_event
+        )
         self.dir_watcher_timer = QTimer(self)
-        self.dir_watcher_timer.timeout.connect(poll_task)
+        self.dir_watcher_timer.timeout.connect(apply_events)
         self.dir_watcher_timer.setSingleShot(True)
 
-        self.dir_watcher_timer.start(fast_ms)
         self.dir_watcher_task.start()
 
     def apply_changes(self, e: FileSystemEvent):
@@ -395,85 +404,74 @@ class Grid(UScrollArea):
 
 
     def load_visible_thumbs_images(self):
+        """
+        Передает в ThumbPool.schedule Thumb без изображений в видимой области
+        и в пределах prefetch_screens экранов выше и ниже нее.
+        Приоритет - расстояние до видимой области, затем положение сверху вниз.
+        Вызывается при каждой прокрутке: ожидающие Thumb, которые ушли
+        из этой зоны, ThumbPool отбрасывает, а при возвращении они
+        ставятся снова.
+        """
         if not self.grid_wid.isVisible():
             return
-        
-        thumbs: list[Thumb] = []
+
+        items: list[tuple[tuple, DataItem]] = []
         self.grid_wid.layout().activate() 
         visible_rect = self.viewport().rect()  # область видимой части
+        margin = visible_rect.height() * self.prefetch_screens
+        offset = self.grid_wid.pos()
         for thumb in self.url_to_wid.values():
             stmt = (
                 thumb.data_item.qimages,
-                thumb.data_item.type_ not in ImgUtils.ext_all,
+                thumb.data_item.type_ not in (*ImgUtils.ext_all, Static.folder_type),
                 thumb in self.loaded_thumbs
             )
             if any(stmt):
                 continue
-            widget_rect = self.viewport().mapFromGlobal(
-                thumb.mapToGlobal(thumb.rect().topLeft())
-            )
-            qsize = QSize(thumb.width(), thumb.height())
-            widget_rect = QRect(widget_rect, qsize)
-            if visible_rect.intersects(widget_rect):
-                thumbs.append(thumb)
+            widget_rect = thumb.geometry().translated(offset)
+            if widget_rect.bottom() < visible_rect.top():
+                distance = visible_rect.top() - widget_rect.bottom()
+            elif widget_rect.top() > visible_rect.bottom():
+                distance = widget_rect.top() - visible_rect.bottom()
+            else:
+                distance = 0
+            if distance <= margin:
+                priority = (distance, widget_rect.top(), widget_rect.left())
+                items.append((priority, thumb.data_item))
 
-        if thumbs:
-            self.loaded_thumbs.extend(thumbs)
-            self._start_load_images_task(thumbs)
+        ThumbPool.schedule(self.thumb_owner, items)
 
-    def _start_load_images_task(self, thumbs: list[Thumb]):
+    def update_thumb(self, msg: ThumbMsg):
         """
-        Запускает фоновую задачу загрузки изображений для списка Thumb.
         Изображения загружаются из базы данных или из директории, если в БД нет.
         """
-
-        def update_thumb(data_item: DataItem):
-            try:
-                thumb = self.url_to_wid[data_item.src]
-                thumb.data_item.partial_hash = data_item.partial_hash
-                thumb.data_item.rating = data_item.rating
-                thumb.set_blue_text()
-                if data_item.img_array is not None:
-                    qimages = {}
-                    original_qimage = Utils.qimage_from_array(
-                        image=data_item.img_array
-                    )
-                    if original_qimage is not None:
-                        qimages["src"] = original_qimage
-                        for size in Static.image_sizes:
-                            resized_qimage = Utils.scaled(
-                                qimage=original_qimage,
-                                size=size
-                            )
-                            qimages[size] = resized_qimage
-                        thumb.data_item.qimages = qimages
-                        thumb.set_image()
-            except RuntimeError as e:
-                print("grid > set_thumb_image runtime err")
-
-        def poll_task(img_task: ProcessWorker, img_timer: QTimer):
-            img_timer.stop()
-            q = img_task.process_queue
-            while not q.empty():
-                data_item: DataItem = q.get()
-                update_thumb(data_item)
-
-            if not img_task.is_alive() and q.empty():
-                img_task.terminate_join()
-            else:
-                img_timer.start(self.img_timer_ms)
-
-        img_task = ProcessWorker(
-            target=ImgLoader.start,
-            args=([i.data_item for i in thumbs], )
-        )
-
-        img_timer = QTimer(self)
-        img_timer.setSingleShot(True)
-        img_timer.timeout.connect(lambda: poll_task(img_task, img_timer))
-        self.proc_timer_dict[img_task] = img_timer
-        img_task.start()
-        img_timer.start(self.img_timer_ms)
+        try:
+            thumb = self.url_to_wid[msg.src]
+            thumb.data_item.partial_hash = msg.partial_hash
+            thumb.data_item.rating = msg.rating
+            thumb.set_blue_text()
+            if msg.img_array is not None:
+                original_qimage = Utils.qimage_from_array(
+                    image=msg.img_array
+                )
+                if original_qimage is not None:
+                    # copy: QImage не должен ссылаться на буфер img_array,
+                    # массив освобождается вместе с msg
+                    thumb.data_item.set_qimage(original_qimage.copy())
+                    msg.img_array = None
+                    thumb.set_image()
+        except RuntimeError as e:
+            print("grid > set_thumb_image runtime err")
+
+    def update_thumbs_finished(self, data_items: list[DataItem]):
+        """
+        Thumb, для которых задание ThumbPool завершено (даже если изображение
+        не прочиталось), больше не ставятся в очередь.
+        """
+        for i in data_items:
+            thumb = self.url_to_wid.get(i.src)
+            if thumb:
+                self.loaded_thumbs.add(thumb)
 
     def reload_rubber(self):
         self.rubberBand.deleteLater()
@@ -738,17 +736,30 @@ class Grid(UScrollArea):
     def new_rating_multiple_start(self, rating: int):
         """
         Устанавливает рейтинг для выделенных в сетке виджетов:
-        - Делается запись в базу данных через URunnable
-        - При успешной записи URunnable испускает сигнал finished
+        - Делается одна запись в базу данных через MultipleRatingTask
+        - При успешной записи MultipleRatingTask испускает сигнал finished
+        со списком обновленных DataItem
         """
-
-        for wid in self.selected_thumbs:
-            if wid.data_item.type_ not in ImgUtils.ext_all:
-                continue
-            self.rating_task = RatingTask(self.main_win_item.main_dir, wid.data_item, rating)
-            cmd_ = lambda d=wid.data_item: self.set_thumb_rating(d, rating)
-            self.rating_task.sigs.finished_.connect(cmd_)
-            UThreadPool.start(self.rating_task)
+        def fin(data_items: list[DataItem]):
+            for i in data_items:
+                try:
+                    self.set_thumb_rating(i, rating)
+                except (AttributeError, RuntimeError):
+                    # виджет успели удалить, пока шла запись в БД
+                    continue
+
+        data_items = [
+            wid.data_item
+            for wid in self.selected_thumbs
+            if wid.data_item.type_ in (*ImgUtils.ext_all, Static.folder_type)
+        ]
+        if not data_items:
+            return
+        self.rating_task = MultipleRatingTask(
+            self.main_win_item.main_dir, data_items, rating
+        )
+        self.rating_task.sigs.finished_.connect(fin)
+        UThreadPool.start(self.rating_task)
         
     def clear_selected_widgets(self):
         """
@@ -862,7 +873,7 @@ class Grid(UScrollArea):
                 fav_action.triggered.connect(cmd_)
                 menu_.addAction(fav_action)
 
-        if wid.data_item.type_ in ImgUtils.ext_all:
+        if wid.data_item.type_ in (*ImgUtils.ext_all, Static.folder_type):
             rating_menu = ItemActions.RatingMenu(menu_, wid.data_item.rating)
             rating_menu.new_rating.connect(self.new_rating_multiple_start)
             menu_.addMenu(rating_menu)
@@ -1286,9 +1297,7 @@ class Grid(UScrollArea):
     def deleteLater(self):
         if self.dir_watcher_task:
             self.dir_watcher_task.terminate_join()
-        for proc, timer in self.proc_timer_dict.items():
-            timer.stop()
-            proc.terminate_join()
+        ThumbPool.cancel(self.thumb_owner)
         urls = [i.data_item.src for i in self.selected_thumbs]
         self.main_win_item.set_urls_to_select(urls)
         return super().deleteLater()
@@ -1296,9 +1305,7 @@ class Grid(UScrollArea):
     def closeEvent(self, a0):
         if self.dir_watcher_task:
             self.dir_watcher_task.terminate_join()
-        for proc, timer in self.proc_timer_dict.items():
-            timer.stop()
-            proc.terminate_join()
+        ThumbPool.cancel(self.thumb_owner)
         urls = [i.src for i in self.selected_thumbs]
         self.main_win_item.set_urls_to_select(urls)
         return super().closeEvent(a0)
@@ -1,4 +1,5 @@
 import os
+import time
 
 from PyQt5.QtCore import Qt, QTimer, pyqtSignal
 from PyQt5.QtGui import QDragEnterEvent, QDropEvent
@@ -132,36 +133,48 @@ class GridSearch(Grid):
                 self.win_missed_files.center(self.window())
                 self.win_missed_files.show()
         
-        def poll_task(missed_files: list[str]):
-            self.search_timer.stop()
-            q = self.search_task.process_queue
-            data_items: list[DataItem] = []
-            while not q.empty():
-                data_item, tmp_missed_files = q.get()
-                missed_files.clear()
-                missed_files.extend(tmp_missed_files)
-                data_items.append(data_item)
+        def on_msg(msg: tuple):
+            # ("item", DataItem.to_msg()) или ("missed", list[str]) в конце
+            kind, data = msg
+            if kind == "missed":
+                missed_files.extend(data)
+                return
+            data_items.append(DataItem.from_msg(data))
+            if not self.search_timer.isActive():
+                # первые результаты показываются сразу, дальше сетка
+                # перестраивается не чаще раза в search_timer_ms
+                elapsed_ms = int((time.monotonic() - last_flush) * 1000)
+                self.search_timer.start(max(0, self.search_timer_ms - elapsed_ms))
+
+        def flush():
+            nonlocal last_flush
             if data_items:
                 for i in data_items:
                     create_thumb(i)
+                data_items.clear()
                 self.rearrange_thumbs()
-            if not self.search_task.is_alive() and q.empty():
-                fin(missed_files)
-                self.search_task.terminate_join()
-            else:
-                self.search_timer.start(self.search_timer_ms)
+            last_flush = time.monotonic()
+
+        def finished():
+            self.search_timer.stop()
+            flush()
+            fin(missed_files)
+            self.search_task.terminate_join()
 
         missed_files: list[str] = []
+        data_items: list[DataItem] = []
+        last_flush = 0.0
         self.is_grid_search = True
         Thumb.calc_size()
         self.search_item.root_dir = self.main_win_item.main_dir
         self.search_task = SearchTaskWorker(target=SearchTask.start, args=(self.search_item, ))
+        self.search_task.connect_queue(self.search_task.process_queue, on_msg)
+        self.search_task.connect_finished(finished)
         self.search_timer = QTimer(self)
         self.search_timer.setSingleShot(True)
-        self.search_timer.timeout.connect(lambda: poll_task(missed_files))
+        self.search_timer.timeout.connect(flush)
 
         self.search_task.start()
-        self.search_timer.start(self.search_timer_ms)
 
     def update_gui(self):
         self.total_count_update.emit((len(self.selected_thumbs), len(self.cell_to_wid)))
@@ -19,8 +19,8 @@ class LoadingWidget(QLabel):
 
 
 class GridStandart(Grid):
-    scroll_timer_ms = 500
-    finder_timer_ms = 200
+    # ThumbPool сам отбрасывает устаревшие задания, большая задержка не нужна
+    scroll_timer_ms = 100
     timeout_timer_ms = 15000
 
     def __init__(self, main_win_item: MainWinItem, is_grid_search: bool):
@@ -74,38 +74,26 @@ class GridStandart(Grid):
     def start_dir_scaner(self):
 
         def timeout_task():
-            self.finder_timer.stop()
             self.finder_task.terminate_join()
             dir_item = DirItem(self.main_win_item, self.sort_item, JsonData.show_hidden)
             self.finalize_dir_scaner(dir_item)
 
-        def poll_task():
-            self.finder_timer.stop()
-            q = self.finder_task.process_queue
-
-            if not q.empty():
-                dir_item: DirItem = q.get()
-                self.finalize_dir_scaner(dir_item)
-
-            if not self.finder_task.is_alive():
-                self.timeout_timer.stop()
-                self.finder_task.terminate_join()
-            else:
-                self.finder_timer.start(self.finder_timer_ms)
+        def finished_task():
+            self.timeout_timer.stop()
+            self.finder_task.terminate_join()
 
         dir_item = DirItem(self.main_win_item, self.sort_item, JsonData.show_hidden)
         self.finder_task = ProcessWorker(target=DirScaner.start, args=(dir_item, ))
-
-        self.finder_timer = QTimer(self)
-        self.finder_timer.setSingleShot(True)
-        self.finder_timer.timeout.connect(poll_task)
+        self.finder_task.connect_queue(
+            self.finder_task.process_queue, self.finalize_dir_scaner
+        )
+        self.finder_task.connect_finished(finished_task)
 
         self.timeout_timer = QTimer(self)
         self.timeout_timer.setSingleShot(True)
         self.timeout_timer.timeout.connect(timeout_task)
 
         self.finder_task.start()
-        self.finder_timer.start(self.finder_timer_ms)
         self.timeout_timer.start(self.timeout_timer_ms)
 
     def finalize_dir_scaner(self, dir_item: DirItem):
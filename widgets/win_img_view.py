@@ -1,7 +1,7 @@
 import os
 
 from PyQt5.QtCore import QEvent, QPointF, QSize, Qt, QTimer, pyqtSignal
-from PyQt5.QtGui import (QContextMenuEvent, QCursor, QImage, QKeyEvent,
+from PyQt5.QtGui import (QContextMenuEvent, QCursor, QKeyEvent,
                          QMouseEvent, QPixmap, QResizeEvent, QTransform)
 from PyQt5.QtSvg import QSvgWidget
 from PyQt5.QtWidgets import (QApplication, QFrame, QGraphicsPixmapItem,
@@ -9,8 +9,7 @@ from PyQt5.QtWidgets import (QApplication, QFrame, QGraphicsPixmapItem,
                              QLabel, QVBoxLayout, QWidget)
 
 from cfg import Static
-from system.multiprocess import ProcessWorker, ReadImg
-from system.tasks import UThreadPool, ImgArrayQImage
+from system.multiprocess import ProcessWorker, ReadImg, SharedImg
 from system.utils import Utils
 
 from ._base_widgets import UMenu, USvgSqareWidget, WinBase
@@ -209,7 +208,7 @@ class NextImgBtn(SwitchImgBtn):
 
 
 class WinImgView(WinBase):
-    cached_images: dict[str, QImage] = {}
+    cached_images: dict[str, SharedImg] = {}
     move_to_wid = pyqtSignal(object)
     move_to_url = pyqtSignal(str)
     new_rating = pyqtSignal(tuple)
@@ -231,6 +230,7 @@ class WinImgView(WinBase):
         )
 
         self.read_img_task = None
+        self.read_img_shm: str = None
         self.is_selection = is_selection
         self.url_to_wid: dict[str, Thumb] = url_to_wid
         self.urls: list = [i for i in self.url_to_wid]
@@ -292,7 +292,7 @@ class WinImgView(WinBase):
         self.text_label.hide()
 
         if self.current_path in WinImgView.cached_images:
-            qimage = WinImgView.cached_images[self.current_path]
+            qimage = WinImgView.cached_images[self.current_path].qimage
             pixmap = QPixmap.fromImage(qimage)
             self.restart_img_wid(pixmap)
 
@@ -328,37 +328,69 @@ class WinImgView(WinBase):
             i.raise_()
 
     def load_image(self):
-        def fin(src: str, qimage: QImage):
-            self.cached_images[src] = qimage
-            self.restart_img_wid(QPixmap.fromImage(qimage))
-
-        def poll_task():
-            q = self.read_img_task.process_queue
-            if not q.empty():
-                src, img_array = q.get()
-                if img_array is None:
-                    self.show_text_label(self.error_text)
-                elif src == self.current_path:
-                    self.qimage_task = ImgArrayQImage(img_array)
-                    self.qimage_task.sigs.finished_.connect(
-                            lambda qimage: fin(src, qimage)
-                    )
-                    UThreadPool.start(self.qimage_task)
-
-            if not self.read_img_task.is_alive():
-                self.read_img_task.terminate_join()
+        def fin(src: str, desc: tuple):
+            shared_img = SharedImg.attach(desc)
+            if shared_img is None or shared_img.qimage is None:
+                self.show_text_label(self.error_text)
+                return
+            if src != self.current_path:
+                shared_img.release()
+                return
+            self.cache_image(src, shared_img)
+            self.restart_img_wid(QPixmap.fromImage(shared_img.qimage))
+
+        def on_msg(task: ProcessWorker, msg: tuple):
+            # окно могло переключиться на другое изображение
+            if task is not self.read_img_task:
+                return
+            src, desc = msg
+            if desc is None:
+                self.show_text_label(self.error_text)
             else:
-                QTimer.singleShot(100, poll_task)
-        
-        if self.read_img_task:
-            self.read_img_task.terminate_join()
+                fin(src, desc)
+            self.read_img_shm = None
+
+        def finished(task: ProcessWorker, shm_name: str):
+            task.terminate_join()
+            # процесс мог упасть, не отправив описание сегмента
+            if self.read_img_shm == shm_name:
+                SharedImg.discard(shm_name)
+                self.read_img_shm = None
 
+        self.stop_read_img_task()
+
+        self.read_img_shm = SharedImg.new_name()
         self.read_img_task = ProcessWorker(
             target=ReadImg.start,
-            args=(self.current_path, True, )
+            args=(self.current_path, True, self.read_img_shm)
         )
-        self.read_img_task.start()
-        QTimer.singleShot(100, poll_task)
+        task, shm_name = self.read_img_task, self.read_img_shm
+        task.connect_queue(task.process_queue, lambda msg: on_msg(task, msg))
+        task.connect_finished(lambda: finished(task, shm_name))
+        task.start()
+
+    def stop_read_img_task(self):
+        """
+        Процесс мог успеть создать сегмент памяти, его удаляет GUI.
+        """
+        if self.read_img_task:
+            self.read_img_task.terminate_join()
+            self.read_img_task = None
+        if self.read_img_shm:
+            SharedImg.discard(self.read_img_shm)
+            self.read_img_shm = None
+
+    def cache_image(self, src: str, shared_img: SharedImg):
+        old = WinImgView.cached_images.pop(src, None)
+        if old is not None:
+            old.release()
+        WinImgView.cached_images[src] = shared_img
+
+    @classmethod
+    def clear_cache(cls):
+        for i in cls.cached_images.values():
+            i.release()
+        cls.cached_images.clear()
 
     def rotate_image(self, value: int):
         pixmap = self.img_wid.pixmap_item.pixmap()
@@ -483,7 +515,8 @@ class WinImgView(WinBase):
         WinImgView.xx = self.x()
         WinImgView.yy = self.y()
 
-        WinImgView.cached_images.clear()
+        self.stop_read_img_task()
+        WinImgView.clear_cache()
     
         self.closed.emit()
         return super().deleteLater()
@@ -495,7 +528,8 @@ class WinImgView(WinBase):
         WinImgView.xx = self.x()
         WinImgView.yy = self.y()
 
-        WinImgView.cached_images.clear()
+        self.stop_read_img_task()
+        WinImgView.clear_cache()
 
         self.closed.emit()
         return super().closeEvent(a0)
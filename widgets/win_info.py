@@ -1,6 +1,6 @@
 import os
 
-from PyQt5.QtCore import Qt, QTimer, pyqtSignal
+from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtGui import QContextMenuEvent, QKeyEvent
 from PyQt5.QtWidgets import (QAction, QGraphicsOpacityEffect, QGridLayout,
                              QLabel, QSpacerItem)
@@ -113,16 +113,9 @@ class WinInfo(WinMinCloseOnly):
 
     def single_img(self):
 
-        def poll_task(resol_label: SelectableLabel):
-            q = self.img_res_task.process_queue
-            if not q.empty():
-                resol = q.get()
-                resol_label.setText(resol)
-                self.set_transparent()
-            if not self.img_res_task.is_alive():
-                self.img_res_task.terminate_join()
-            else:
-                QTimer.singleShot(100, lambda: poll_task(resol_label))
+        def fin(resol: str):
+            resol_label.setText(resol)
+            self.set_transparent()
 
         row = 0
         item = self.data_items[0]
@@ -150,8 +143,9 @@ class WinInfo(WinMinCloseOnly):
                 target=ImgRes.start,
                 args=(item.src, )
             )
+            self.img_res_task.connect_queue(self.img_res_task.process_queue, fin)
+            self.img_res_task.connect_finished(self.img_res_task.terminate_join)
             self.img_res_task.start()
-            QTimer.singleShot(100, lambda: poll_task(resol_label))
 
     def single_file(self):
         row = 0
@@ -174,22 +168,14 @@ class WinInfo(WinMinCloseOnly):
 
     def multiple_items(self):
 
-        def poll_task():
-            q = self.info_task.process_queue
-            if not q.empty():
-                info_item: MultipleInfoItem = q.get()
-                total_size = self.findChildren(SelectableLabel)[3]
-                total_files = self.findChildren(SelectableLabel)[5]
-                total_folders = self.findChildren(SelectableLabel)[7]
-                total_size.setText(info_item.total_size)
-                total_files.setText(info_item.total_files)
-                total_folders.setText(info_item.total_folders)
-                self.set_transparent()
-            
-            if not self.info_task.is_alive():
-                self.info_task.terminate_join()
-            else:
-                QTimer.singleShot(100, poll_task)
+        def fin(info_item: MultipleInfoItem):
+            total_size = self.findChildren(SelectableLabel)[3]
+            total_files = self.findChildren(SelectableLabel)[5]
+            total_folders = self.findChildren(SelectableLabel)[7]
+            total_size.setText(info_item.total_size)
+            total_files.setText(info_item.total_files)
+            total_folders.setText(info_item.total_folders)
+            self.set_transparent()
 
         row = 0
         root = os.path.dirname(self.data_items[0].src)
@@ -213,27 +199,20 @@ class WinInfo(WinMinCloseOnly):
         ]
 
         self.info_task = ProcessWorker(target=MultipleInfo.start, args=(items, JsonData.show_hidden, ))
+        self.info_task.connect_queue(self.info_task.process_queue, fin)
+        self.info_task.connect_finished(self.info_task.terminate_join)
         self.info_task.start()
-        QTimer.singleShot(100, poll_task)
 
     def single_folder(self):
 
-        def poll_task():
-            q = self.info_task.process_queue
-            if not q.empty():
-                info_item: MultipleInfoItem = q.get()
-                total_size = self.findChildren(SelectableLabel)[5]
-                total_files = self.findChildren(SelectableLabel)[13]
-                total_folders = self.findChildren(SelectableLabel)[15]
-                total_size.setText(info_item.total_size)
-                total_files.setText(info_item.total_files)
-                total_folders.setText(info_item.total_folders)
-                self.set_transparent()
-            
-            if not self.info_task.is_alive():
-                self.info_task.terminate_join()
-            else:
-                QTimer.singleShot(100, poll_task)
+        def fin(info_item: MultipleInfoItem):
+            total_size = self.findChildren(SelectableLabel)[5]
+            total_files = self.findChildren(SelectableLabel)[13]
+            total_folders = self.findChildren(SelectableLabel)[15]
+            total_size.setText(info_item.total_size)
+            total_files.setText(info_item.total_files)
+            total_folders.setText(info_item.total_folders)
+            self.set_transparent()
 
         row = 0
         item = self.data_items[0]
@@ -261,8 +240,9 @@ class WinInfo(WinMinCloseOnly):
         ]
 
         self.info_task = ProcessWorker(target=MultipleInfo.start, args=(items, JsonData.show_hidden, ))
+        self.info_task.connect_queue(self.info_task.process_queue, fin)
+        self.info_task.connect_finished(self.info_task.terminate_join)
         self.info_task.start()
-        QTimer.singleShot(100, poll_task)
 
     def lined_text(self, text: str, limit: int = 50):
         if len(text) > limit:
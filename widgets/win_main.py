@@ -11,7 +11,7 @@ from PyQt5.QtWidgets import (QApplication, QFrame, QHBoxLayout, QLabel,
 from cfg import Dynamic, JsonData, Static
 from system.items import (ClipboardItem, DataItem, MainWinItem, PathFixerItem,
                           SearchItem, SortItem)
-from system.multiprocess import PathFixer, ProcessWorker
+from system.multiprocess import PathFixer, ProcessWorker, ThumbPool
 from system.paletes import UPallete
 from system.shared_utils import SharedUtils
 from system.tasks import RatingTask, UThreadPool
@@ -323,32 +323,24 @@ class WinMain(WinBase):
 
     def path_finder_cmd(self, clipboard_path: str):
 
-        def poll_task():
-            q = self.path_fixer_task.process_queue
-
-            if not q.empty():
-                fixer_item: PathFixerItem = q.get()
-                if fixer_item.fixed_path is None:
-                    return
-                if fixer_item.is_dir:
-                    self.main_win_item.main_dir = fixer_item.fixed_path
-                else:
-                    self.main_win_item.main_dir = os.path.dirname(fixer_item.fixed_path)
-                    self.main_win_item.set_go_to(fixer_item.fixed_path)
-                self.top_bar.new_history_item(self.main_win_item.main_dir)
-                self.load_st_grid()
-
-            if not self.path_fixer_task.is_alive():
-                self.path_fixer_task.terminate_join()
+        def fin(fixer_item: PathFixerItem):
+            if fixer_item.fixed_path is None:
+                return
+            if fixer_item.is_dir:
+                self.main_win_item.main_dir = fixer_item.fixed_path
             else:
-                QTimer.singleShot(100, poll_task)
+                self.main_win_item.main_dir = os.path.dirname(fixer_item.fixed_path)
+                self.main_win_item.set_go_to(fixer_item.fixed_path)
+            self.top_bar.new_history_item(self.main_win_item.main_dir)
+            self.load_st_grid()
 
         self.path_fixer_task = ProcessWorker(
             target=PathFixer.start,
             args=(clipboard_path, )
         )
+        self.path_fixer_task.connect_queue(self.path_fixer_task.process_queue, fin)
+        self.path_fixer_task.connect_finished(self.path_fixer_task.terminate_join)
         self.path_fixer_task.start()
-        QTimer.singleShot(100, poll_task)
 
     def open_settings(self, *args):
         self.sett_win = WinSettings()
@@ -529,6 +521,7 @@ class WinMain(WinBase):
 
     def on_exit(self):
         self.grid.deleteLater()
+        ThumbPool.stop()
         JsonData.write_json_data()
         SharedUtils.exit_force()
     
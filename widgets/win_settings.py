@@ -9,10 +9,12 @@ from PyQt5.QtWidgets import (QCheckBox, QFrame, QSpacerItem, QGroupBox,
                              QHBoxLayout, QLabel, QVBoxLayout, QWidget)
 
 from cfg import JsonData, Static
+from system.multiprocess import ThumbPool
 from system.shared_utils import SharedUtils
 from system.tasks import CacheCleaner, DataSizeCounter, UThreadPool
 
-from ._base_widgets import HSep, WinMinCloseOnly, ULabel, USvgSqareWidget
+from ._base_widgets import (HSep, SmallBtn, WinMinCloseOnly, ULabel,
+                            USvgSqareWidget)
 # возможно в main win
 from .warn_win import ConfirmWindow, WinWarn
 
@@ -60,7 +62,9 @@ class SvgArrow(QSvgWidget):
 class DataSizeWidget(GroupWid):
     data_size_text = "Данные приложения:"
     files_text = "Кол-во файлов:"
+    hash_cache_text = "Кэш рейтингов:"
     calculating = "вычисляю..."
+    recalc_text = "Пересчитать"
 
     def __init__(self):
         super().__init__()
@@ -76,16 +80,64 @@ class DataSizeWidget(GroupWid):
 
         self.hor_wid.layout_.addStretch()
 
-        self.start_task()
+        self.recalc_btn = SmallBtn(self.recalc_text)
+        self.recalc_btn.clicked.connect(lambda: self.start_task(True))
+        self.hor_wid.layout_.addWidget(self.recalc_btn)
+
+        self.layout_.addWidget(HSep())
+
+        self.count_wid = GroupChild()
+        self.layout_.addWidget(self.count_wid)
+        self.count_wid.layout_.setSpacing(5)
+
+        self.count_descr_label = QLabel(self.files_text)
+        self.count_wid.layout_.addWidget(self.count_descr_label)
+
+        self.count_label = QLabel(self.calculating)
+        self.count_wid.layout_.addWidget(self.count_label)
+
+        self.count_wid.layout_.addStretch()
+
+        self.layout_.addWidget(HSep())
+
+        self.hash_cache_wid = GroupChild()
+        self.layout_.addWidget(self.hash_cache_wid)
+        self.hash_cache_wid.layout_.setSpacing(5)
+
+        self.hash_cache_descr_label = QLabel(self.hash_cache_text)
+        self.hash_cache_wid.layout_.addWidget(self.hash_cache_descr_label)
+
+        # счетчики HashCache процессов ThumbPool
+        stats = ThumbPool.get_cache_stats()
+        self.hash_cache_label = QLabel(
+            f"попаданий {stats['hits']}, промахов {stats['misses']}"
+        )
+        self.hash_cache_wid.layout_.addWidget(self.hash_cache_label)
 
-    def start_task(self):
+        self.hash_cache_wid.layout_.addStretch()
 
+        self.start_task()
+
+    def start_task(self, recalc: bool = False):
+        """
+        recalc: пересчитать размер каждой миниатюры на диске,
+        иначе данные берутся из счетчиков в БД
+        """
         def fin(data):
+            self.recalc_btn.setDisabled(False)
             self.size_label.setText(
                 SharedUtils.get_f_size(data["total"])
             )
+            self.count_label.setText(
+                format(data["count"], ",").replace(",", " ")
+            )
+
+        if recalc:
+            self.recalc_btn.setDisabled(True)
+            self.size_label.setText(self.calculating)
+            self.count_label.setText(self.calculating)
 
-        self.task_ = DataSizeCounter()
+        self.task_ = DataSizeCounter(recalc)
         self.task_.sigs.finished_.connect(fin)
         UThreadPool.start(self.task_)
 
@@ -189,6 +241,7 @@ class CheckboxWidgets(GroupWid):
     " если путь скопирован в буфер обмена.",
     ])
     show_texts_text = "Показывать подписи к кнопкам"
+    thumbs_packed_text = "Хранить новые миниатюры в общих файлах"
     left_margin = 7
 
     def __init__(self):
@@ -210,6 +263,11 @@ class CheckboxWidgets(GroupWid):
         self.show_texts = UCheckBox(self.show_texts_text)
         self.layout_.addWidget(self.show_texts)
 
+        self.layout_.addWidget(HSep())
+
+        self.thumbs_packed = UCheckBox(self.thumbs_packed_text)
+        self.layout_.addWidget(self.thumbs_packed)
+
         if JsonData.show_hidden:
             self.show_hidden.setChecked(True)
 
@@ -219,9 +277,13 @@ class CheckboxWidgets(GroupWid):
         if JsonData.show_text:
             self.show_texts.setChecked(True)
 
+        if JsonData.thumbs_packed:
+            self.thumbs_packed.setChecked(True)
+
         self.show_hidden.stateChanged.connect(self.on_state_changed)
         self.enable_go_to.stateChanged.connect(self.on_state_changed_two)
         self.show_texts.stateChanged.connect(self.show_texts_cmd)
+        self.thumbs_packed.stateChanged.connect(self.thumbs_packed_cmd)
         
     def on_state_changed(self, value: int):
         data = {0: False, 2: True}
@@ -232,6 +294,10 @@ class CheckboxWidgets(GroupWid):
         data = {0: False, 2: True}
         JsonData.go_to_now = data.get(value)
 
+    def thumbs_packed_cmd(self, value: int):
+        data = {0: False, 2: True}
+        JsonData.thumbs_packed = data.get(value)
+
     def show_texts_cmd(self):
         if JsonData.show_text:
             JsonData.show_text = False